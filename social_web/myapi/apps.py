@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class MyapiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "myapi"
+
+    def ready(self):
+        from myapi.db import configure_connection
+        from myapi.metrics import install_wrapper
+
+        connection_created.connect(configure_connection)
+        connection_created.connect(install_wrapper)
+
+        # The handlers of the tasks, for the workers too
+        import myapi.suggestions  # noqa: F401
@@ -0,0 +1,157 @@
+"""
+Async versions of the read paths of FriendViewSet and RequestViewSet,
+for the ASGI entry point.
+
+They answer with the same JSON as the sync views, authenticate with the
+JWT only and use the async ORM. The middleware of production runs in
+async mode too, so only the queries go to a thread, not the request.
+"""
+import asyncio
+import functools
+
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from myapi.authentication import JWTAuthentication
+from myapi.cache import aget_or_build, FRIENDS, REQUESTS
+from myapi.utils import aget_relationship
+from myapi.views import FriendViewSet
+from users_site.models import Profile, Friend, FriendRequest, Relationship
+
+
+async def get_profile(request):
+    """
+    Get the profile of the user of the JWT, from the database as the sync
+    views do: the username of the claims is stale after a rename, and the
+    cached data built with it is shared.
+    """
+    result = JWTAuthentication().authenticate(request)
+    if result is None:
+        raise AuthenticationFailed("Unauthenticated")
+
+    user, _ = result
+    profile = await Profile.objects.filter(user_id=user.id).afirst()
+    if profile is None:
+        raise AuthenticationFailed("Unauthenticated")
+    return profile
+
+
+def async_api_view(view):
+    """
+    Allow GET only and pass the profile of the user to the view.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return JsonResponse(
+                {"detail": f'Method "{request.method}" not allowed.'}, status=405
+            )
+        try:
+            me = await get_profile(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=401)
+        return await view(request, me, *args, **kwargs)
+
+    return wrapper
+
+
+async def friends_context(me):
+    data = Friend.objects.filter(user=me).values("friend_id", "friend__username")
+    return {
+        "user": {"id": me.id, "username": me.username},
+        "friends": [
+            {"id": x["friend_id"], "username": x["friend__username"]}
+            async for x in data
+        ],
+    }
+
+
+async def requests_context(me):
+    incoming = FriendRequest.objects.filter(
+        to_user=me, accepted=False
+    ).values("from_user_id", "from_user__username")
+    outgoing = FriendRequest.objects.filter(
+        from_user=me, accepted=False
+    ).values("to_user_id", "to_user__username")
+
+    async def to_list(data, user):
+        return [
+            {"id": x[f"{user}_id"], "username": x[f"{user}__username"]}
+            async for x in data
+        ]
+
+    to_me, from_me = await asyncio.gather(
+        to_list(incoming, "from_user"),
+        to_list(outgoing, "to_user"),
+    )
+    return {
+        "username": me.username,
+        "incoming_requests": to_me,
+        "outgoing_requests": from_me,
+    }
+
+
+@async_api_view
+async def friends_list(request, me):
+    """
+    View a user's list of friends, as FriendViewSet.list with ?paginate=false.
+    """
+    context = await aget_or_build(FRIENDS, me, lambda: friends_context(me))
+    return JsonResponse(context)
+
+
+@async_api_view
+async def friends_detail(request, me, pk):
+    """
+    Get a user friend status with some other user, as FriendViewSet.retrieve.
+    """
+    relationship = await aget_relationship(me, pk)
+    if relationship:
+        friend = relationship.other
+        state = relationship.state
+    else:
+        friend = await Profile.objects.filter(id=pk).afirst()
+        state = Relationship.NONE
+
+    if not friend:
+        return JsonResponse({"message": f"User {pk} dont exist "}, status=400)
+
+    context = {"username": str(friend)}
+    if pk == me.id:
+        context["status"] = "It is you're id man."
+    elif state in FriendViewSet.status_messages:
+        context["status"] = FriendViewSet.status_messages[state]
+    else:
+        context["status"] = "Nothing"
+        return JsonResponse(context, status=400)
+
+    return JsonResponse(context)
+
+
+@async_api_view
+async def requests_list(request, me):
+    """
+    View to the user a list of their outgoing and incoming friend requests.
+    """
+    context = await aget_or_build(REQUESTS, me, lambda: requests_context(me))
+    return JsonResponse(context)
+
+
+@async_api_view
+async def requests_detail(request, me, pk):
+    """
+    Status check with user, as RequestViewSet.retrieve.
+    """
+    relationship = await aget_relationship(me, pk)
+    if relationship:
+        user = relationship.other
+    else:
+        user = await Profile.objects.filter(id=pk).afirst()
+    if not user:
+        return JsonResponse({"message": f"User {pk} dont exist "}, status=400)
+
+    if relationship and relationship.state == Relationship.INCOMING:
+        message = f"User {user.username} wants to add you as a friend"
+    else:
+        message = f"Request to friend user {user.username}"
+    return JsonResponse({"message": message})
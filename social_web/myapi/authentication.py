@@ -0,0 +1,90 @@
+import jwt
+from django.contrib.auth.models import User
+from django.utils.functional import cached_property
+from rest_framework.authentication import BaseAuthentication, CSRFCheck, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+
+from myapi.utils import decode_jwt
+
+
+class JWTUser:
+    """
+    User of a request, built from the claims of the JWT.
+
+    The User row is loaded only when something that is not in the claims
+    is asked for, e.g. ``request.user.email``.
+    """
+    is_active = True
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, payload):
+        self.id = self.pk = payload["id"]
+        self.profile_id = payload.get("profile_id")
+        if "username" in payload:
+            self.username = payload["username"]
+
+    @cached_property
+    def user(self):
+        return User.objects.get(id=self.id)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __str__(self):
+        return self.username
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    Authenticate with the JWT from the ``Authorization: Bearer`` header
+    or from the ``jwt`` cookie set at login, without the database.
+
+    The browser sends the cookie with the requests of any site, so the
+    unsafe methods need the CSRF token with it, as for the session.
+    """
+    keyword = "Bearer"
+    cookie_name = "jwt"
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+
+        if header and header[0].lower() == self.keyword.lower().encode():
+            if len(header) != 2:
+                raise AuthenticationFailed("Invalid JWT token.")
+            try:
+                payload = decode_jwt(header[1].decode())
+            except jwt.ExpiredSignatureError:
+                raise AuthenticationFailed("JWT token has expired.")
+            except (jwt.InvalidTokenError, UnicodeError):
+                raise AuthenticationFailed("Invalid JWT token.")
+            return JWTUser(payload), payload
+
+        token = request.COOKIES.get(self.cookie_name)
+        if not token:
+            return None
+        try:
+            payload = decode_jwt(token)
+        except jwt.InvalidTokenError:
+            # A stale cookie must not lock the user out of the login.
+            return None
+        self.enforce_csrf(request)
+        return JWTUser(payload), payload
+
+    def enforce_csrf(self, request):
+        """
+        Same check as SessionAuthentication.enforce_csrf.
+        """
+        def dummy_get_response(request):
+            return None
+
+        check = CSRFCheck(dummy_get_response)
+        check.process_request(request)
+        reason = check.process_view(request, None, (), {})
+        if reason:
+            raise PermissionDenied(f"CSRF Failed: {reason}")
+
+    def authenticate_header(self, request):
+        return self.keyword
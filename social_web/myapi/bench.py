@@ -0,0 +1,351 @@
+"""
+Benchmark of the /api endpoints on a synthetic social graph.
+
+``seed_graph`` fills the database with profiles whose friend count
+follows a power law, a hub user with many friends, pending requests and
+a long conversation. ``run_benchmark`` drives every route of
+``myapi.urls`` through the test client and reports the latency, the
+number of SQL queries and the allocated memory of each of them.
+
+The benchmarks run with ``bench_settings``: without DEBUG and the
+middleware of the dev settings, the debug toolbar and the stacks of every
+query of ``QueryCheckMiddleware``, which would cost more than most of the
+endpoints themselves.
+"""
+import random
+import statistics
+import time
+import tracemalloc
+from array import array
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from myapi.cache import get_cache
+from myapi.suggestions import rebuild_user_suggestions
+from myapi.urls import router
+from myapi.utils import create_jwt
+from users_site.models import Profile, Friend, FriendRequest, Message, Relationship
+from users_site.search import index_profiles
+
+BATCH_SIZE = 5000
+# Tooling of the dev settings, left out of the benchmarks
+DEV_MIDDLEWARE = [
+    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "myapi.querycheck.QueryCheckMiddleware",
+]
+# Users per call of the bulk request routes
+BULK_SIZE = 10
+
+
+@dataclass
+class Graph:
+    hub: Profile
+    profiles: array = field(default_factory=lambda: array("q"))
+    friends: list = field(default_factory=list)
+    strangers: list = field(default_factory=list)
+    incoming: list = field(default_factory=list)
+
+
+def bulk_insert(model, rows, **kwargs):
+    for start in range(0, len(rows), BATCH_SIZE):
+        model.objects.bulk_create(rows[start:start + BATCH_SIZE], **kwargs)
+
+
+def create_profiles(prefix, count):
+    """
+    Create the users and their profiles, return the profile ids.
+    """
+    password = make_password("Password123")
+    ids = array("q")
+    for start in range(0, count, BATCH_SIZE):
+        names = [f"{prefix}{x}" for x in range(start, min(count, start + BATCH_SIZE))]
+        User.objects.bulk_create(
+            [User(username=name, password=password) for name in names]
+        )
+        users = User.objects.filter(username__in=names).values_list("id", "username")
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id, username=name) for user_id, name in users]
+        )
+        profiles = list(Profile.objects.filter(username__in=names).only("id", "username"))
+        index_profiles(profiles)
+        ids.extend(x.id for x in profiles)
+    return ids
+
+
+def befriend(pairs):
+    friends = []
+    relationships = []
+    for user_id, friend_id in pairs:
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            friends.append(Friend(user_id=a, friend_id=b))
+            relationships.append(
+                Relationship(user_id=a, other_id=b, state=Relationship.FRIENDS)
+            )
+    bulk_insert(Friend, friends, ignore_conflicts=True)
+    bulk_insert(Relationship, relationships, ignore_conflicts=True)
+
+
+def seed_graph(profiles=10000, degree=20, alpha=2.5, hub_degree=1000,
+               messages=1000, reserve=100, seed=0):
+    """
+    Fill the database with a synthetic social graph.
+
+    The friend count of every profile is drawn from a Pareto distribution
+    of the given mean, and the friendships are made by pairing the
+    "stubs" of the profiles at random (configuration model).
+    """
+    rng = random.Random(seed)
+    ids = create_profiles("bench", profiles)
+
+    # Profiles without any relationship, to send and accept requests,
+    # one by one and in bulk
+    strangers = list(create_profiles("stranger", reserve * 2 * (BULK_SIZE + 1)))
+
+    hub = Profile.objects.get(id=ids[0])
+    hub.user.is_staff = True
+    hub.user.save(update_fields=["is_staff"])
+
+    scale = degree * (alpha - 1) / alpha
+    stubs = array("q")
+    for profile_id in ids[1:]:
+        count = min(int(rng.paretovariate(alpha) * scale), profiles - 1)
+        stubs.extend([profile_id] * count)
+    rng.shuffle(stubs)
+
+    pairs = []
+    for x in range(0, len(stubs) - 1, 2):
+        if stubs[x] != stubs[x + 1]:
+            pairs.append((stubs[x], stubs[x + 1]))
+        if len(pairs) >= BATCH_SIZE:
+            befriend(pairs)
+            pairs = []
+    befriend(pairs)
+
+    hub_friends = rng.sample(list(ids[1:]), min(hub_degree, profiles - 1))
+    befriend([(hub.id, friend_id) for friend_id in hub_friends])
+
+    # The friends were inserted in bulk, past the helpers which keep
+    # the mutual friend counts. Those of the hub are enough for the
+    # benchmark, all of them take minutes on the default graph.
+    rebuild_user_suggestions([hub.id])
+
+    # Incoming requests to the hub
+    incoming = strangers[reserve * (BULK_SIZE + 1):]
+    FriendRequest.objects.bulk_create(
+        [FriendRequest(to_user=hub, from_user_id=x) for x in incoming]
+    )
+    bulk_insert(
+        Relationship,
+        [Relationship(user=hub, other_id=x, state=Relationship.INCOMING) for x in incoming]
+        + [Relationship(user_id=x, other=hub, state=Relationship.OUTGOING) for x in incoming],
+    )
+
+    # A long conversation with the first friend of the hub
+    conversation = Message.conversation_key(hub, hub_friends[0])
+    start = timezone.now() - timedelta(minutes=messages)
+    bulk_insert(
+        Message,
+        [
+            Message(
+                conversation=conversation,
+                sender_id=rng.choice([hub.id, hub_friends[0]]),
+                text=f"Message {x}",
+                created_at=start + timedelta(minutes=x),
+            )
+            for x in range(messages)
+        ],
+    )
+
+    return Graph(
+        hub=hub,
+        profiles=ids,
+        friends=hub_friends,
+        strangers=strangers[:reserve * (BULK_SIZE + 1)],
+        incoming=incoming,
+    )
+
+
+def get_cases(graph):
+    """
+    Requests of every route, as functions of the iteration number.
+
+    The cases are named after the route, with the method if it is not
+    the GET. The routes which change the graph get a new user every
+    iteration.
+    """
+    hub = graph.hub
+    chat = graph.friends[0]
+    # The users of the bulk routes follow the ones of the single routes
+    reserve = len(graph.strangers) // (BULK_SIZE + 1)
+
+    def bulk(users, i):
+        start = reserve + i * BULK_SIZE
+        return users[start:start + BULK_SIZE]
+
+    return {
+        "api-root": lambda i: ("get", reverse("api-root"), None),
+        "registration-list": lambda i: (
+            "post",
+            reverse("registration-list"),
+            {"username": f"new{i}", "email": "new@example.com", "password": "Password123"},
+        ),
+        "login-list": lambda i: (
+            "post",
+            reverse("login-list"),
+            {"username": hub.username, "password": "Password123"},
+        ),
+        "token_auth-list": lambda i: ("get", reverse("token_auth-list"), None),
+        "profile-list": lambda i: ("get", reverse("profile-list"), None),
+        "profile-update-user": lambda i: (
+            "put", reverse("profile-update-user"), {"phone": "+999 99 999 99 99"}
+        ),
+        "profile-search": lambda i: (
+            "get", reverse("profile-search"), {"q": f"bench{i}"}
+        ),
+        "friends-list": lambda i: ("get", reverse("friends-list"), None),
+        "friends-suggestions": lambda i: ("get", reverse("friends-suggestions"), None),
+        "friends-statuses": lambda i: (
+            "get",
+            reverse("friends-statuses"),
+            {"ids": ",".join(str(x) for x in graph.friends[:50])},
+        ),
+        "friends-detail": lambda i: (
+            "get", reverse("friends-detail", kwargs={"pk": graph.friends[i + 1]}), None
+        ),
+        "friends-mutual": lambda i: (
+            "get", reverse("friends-mutual", kwargs={"pk": graph.friends[i + 1]}), None
+        ),
+        "friends-path": lambda i: (
+            "get",
+            reverse("friends-path", kwargs={"pk": graph.profiles[-1 - i]}),
+            {"max_hops": 6},
+        ),
+        "friends-list-message": lambda i: (
+            "get", reverse("friends-list-message", kwargs={"pk": chat}), None
+        ),
+        "friends-export-message": lambda i: (
+            "get", reverse("friends-export-message", kwargs={"pk": chat}), None
+        ),
+        "friends-create-message": lambda i: (
+            "post",
+            reverse("friends-create-message", kwargs={"pk": chat}),
+            {"messages": f"Benchmark {i}"},
+        ),
+        "requests-list": lambda i: ("get", reverse("requests-list"), None),
+        "cache_stats-list": lambda i: ("get", reverse("cache_stats-list"), None),
+        "throttle_stats-list": lambda i: ("get", reverse("throttle_stats-list"), None),
+        "profiling-list": lambda i: ("get", reverse("profiling-list"), None),
+        "requests-list:post": lambda i: (
+            "post", reverse("requests-list"), {"to_user": graph.strangers[i]}
+        ),
+        "requests-detail": lambda i: (
+            "get", reverse("requests-detail", kwargs={"pk": graph.incoming[i]}), None
+        ),
+        "requests-bulk": lambda i: (
+            "post", reverse("requests-bulk"), {"ids": bulk(graph.strangers, i)}
+        ),
+        "requests-bulk-answer": lambda i: (
+            "post",
+            reverse("requests-bulk-answer"),
+            {"ids": bulk(graph.incoming, i), "choice": "accept"},
+        ),
+        "requests-create-friend": lambda i: (
+            "post",
+            reverse("requests-create-friend", kwargs={"pk": graph.incoming[i]}),
+            {"choice": "accept"},
+        ),
+        # Last, it removes friends of the hub
+        "friends-detail:delete": lambda i: (
+            "delete", reverse("friends-detail", kwargs={"pk": graph.friends[-1 - i]}), None
+        ),
+    }
+
+
+def route_names():
+    """
+    Names of the routes of ``myapi.urls``, without the format suffixes.
+    """
+    return {
+        url.name for url in router.urls
+        if url.name and "format" not in url.pattern.regex.pattern
+    }
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure(client, case, repeat, cold_cache=False):
+    """
+    Run the request ``repeat`` times, then once more to trace its memory.
+    """
+    timings = []
+    queries = []
+    statuses = set()
+    for i in range(repeat):
+        method, url, data = case(i)
+        if cold_cache:
+            get_cache().clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data=data)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            timings.append(time.perf_counter() - start)
+        queries.append(len(context.captured_queries))
+        statuses.add(response.status_code)
+
+    method, url, data = case(repeat)
+    if cold_cache:
+        get_cache().clear()
+    tracemalloc.start()
+    response = getattr(client, method)(url, data=data)
+    if response.streaming:
+        b"".join(response.streaming_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "queries": max(queries),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "statuses": sorted(statuses),
+    }
+
+
+def bench_settings():
+    """
+    Settings of production, whatever DJANGO_ENV: no DEBUG, no dev middleware.
+    """
+    return override_settings(
+        DEBUG=False,
+        MIDDLEWARE=[x for x in settings.MIDDLEWARE if x not in DEV_MIDDLEWARE],
+    )
+
+
+def run_benchmark(graph, repeat=50, cold_cache=False):
+    client = APIClient()
+    client.cookies["jwt"] = create_jwt(graph.hub.user)
+
+    results = {}
+    # The hub writes every iteration, far above the rates of the throttles.
+    # The tasks are queued, as in production, and left to the workers.
+    with bench_settings(), override_settings(
+        MYAPI_THROTTLE_RATES={},
+        MYAPI_TASKS={**settings.MYAPI_TASKS, "EAGER": False},
+    ):
+        for name, case in get_cases(graph).items():
+            results[name] = measure(client, case, repeat, cold_cache)
+    return results
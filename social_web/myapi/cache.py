@@ -0,0 +1,103 @@
+"""
+Cache of the friends lists and request inboxes, one entry per profile.
+
+The entries are built by the views on a miss and dropped by the helpers
+of ``myapi.utils`` once the transaction that changed them is committed.
+
+Every entry has a version next to it, the time in nanoseconds at which
+it was first asked for after a change, which the views use as ETag
+without building the data.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from myapi.db import use_primary
+
+FRIENDS = "friends"
+REQUESTS = "requests"
+PROFILE = "profile"
+
+# Counters of this process.
+stats = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def get_cache():
+    return caches[settings.MYAPI_CACHE]
+
+
+def cache_key(kind, profile):
+    return f"myapi:{kind}:{getattr(profile, 'pk', profile)}"
+
+
+def version_key(kind, profile):
+    return f"myapi:version:{kind}:{getattr(profile, 'pk', profile)}"
+
+
+def get_version(kind, profile):
+    """
+    Get the version of the data of the profile.
+    """
+    return get_cache().get_or_set(
+        version_key(kind, profile), time.time_ns, settings.MYAPI_CACHE_TIMEOUT
+    )
+
+
+def get_or_build(kind, profile, build):
+    """
+    Get the cached data of the profile, or build and cache it.
+    """
+    cache = get_cache()
+    key = cache_key(kind, profile)
+
+    data = cache.get(key)
+    if data is None:
+        stats["misses"] += 1
+        # Not from a replica, which may not have the last change yet
+        with use_primary():
+            data = build()
+        cache.set(key, data, settings.MYAPI_CACHE_TIMEOUT)
+    else:
+        stats["hits"] += 1
+    return data
+
+
+async def aget_or_build(kind, profile, build):
+    """
+    Same as get_or_build, for async views: ``build`` is a coroutine function.
+    """
+    cache = get_cache()
+    key = cache_key(kind, profile)
+
+    data = await cache.aget(key)
+    if data is None:
+        stats["misses"] += 1
+        with use_primary():
+            data = await build()
+        await cache.aset(key, data, settings.MYAPI_CACHE_TIMEOUT)
+    else:
+        stats["hits"] += 1
+    return data
+
+
+def invalidate(kind, *profiles):
+    """
+    Drop the cached data and versions of the profiles after the commit.
+    """
+    keys = [cache_key(kind, profile) for profile in profiles]
+    keys += [version_key(kind, profile) for profile in profiles]
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def get_stats():
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,39 @@
+"""
+Tuning of the database connections, and the replica of the reads.
+
+SQLite connections run the PRAGMAs of ``settings.MYAPI_SQLITE_PRAGMAS``:
+with the write-ahead log the readers go on while a request writes,
+``synchronous=normal`` only syncs the log at the checkpoints, which is
+safe with the WAL, and ``busy_timeout`` makes a second writer wait for
+the lock instead of failing with "database is locked".
+
+``replica`` holds the alias the reads of the current request go to, see
+``myapi.routers``.
+"""
+import contextlib
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Alias of the reads of the current request, None for the primary
+replica = ContextVar("myapi_replica", default=None)
+
+
+@contextlib.contextmanager
+def use_primary():
+    """
+    Read from the primary within the block, e.g. what goes to the cache.
+    """
+    token = replica.set(None)
+    try:
+        yield
+    finally:
+        replica.reset(token)
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "MYAPI_SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
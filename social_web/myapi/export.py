@@ -0,0 +1,55 @@
+"""
+Streaming export of a conversation, read from the database in chunks.
+"""
+import csv
+import json
+
+from users_site.models import Message
+
+CHUNK_SIZE = 2000
+
+FIELDS = ["id", "sender", "username", "text", "created_at"]
+
+
+def iter_messages(conversation):
+    """
+    Messages of the conversation, oldest first, as tuples of FIELDS.
+    """
+    return Message.objects.filter(
+        conversation=conversation,
+    ).order_by("created_at", "id").values_list(
+        "id",
+        "sender_id",
+        "sender__username",
+        "text",
+        "created_at",
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_ndjson(rows):
+    for row in rows:
+        data = dict(zip(FIELDS, row))
+        data["created_at"] = data["created_at"].isoformat()
+        yield json.dumps(data, ensure_ascii=False) + "\n"
+
+
+class Echo:
+    """
+    File-like object giving back what is written to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row[:-1] + (row[-1].isoformat(),))
+
+
+EXPORTS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv"),
+}
@@ -0,0 +1,244 @@
+"""
+In-memory index of the friends, for the multi-hop queries.
+
+Every profile has a sorted ``array`` of the ids of its friends, loaded
+once from ``Friend``: about 8 bytes per friend, with no model instance
+and no query per hop. The mutual friends of two users are an
+intersection of two arrays, and the shortest path between them a
+bidirectional breadth-first search.
+
+Every process has its own index. The helpers of ``myapi.utils`` change
+the index of their process after the commit, and log the profiles whose
+friends changed in the cache under a generation number. Before a query,
+the index reloads the friends of the profiles logged by the other
+processes since its generation, or everything when the log is gone.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from math import log2
+
+from django.db import transaction
+
+from myapi.cache import get_cache
+from myapi.db import use_primary
+from users_site.models import Friend
+
+TYPECODE = "q"
+GENERATION_KEY = "myapi:graph:generation"
+# Changes kept in the cache, beyond which a process reloads everything
+MAX_LOG = 1000
+LOG_TIMEOUT = 60 * 60
+
+
+def change_key(generation):
+    return f"myapi:graph:change:{generation}"
+
+
+def start_log(cache):
+    """
+    Start the log, if there is none, from the current time in
+    nanoseconds: a process never mistakes a new log, e.g. after the
+    cache was cleared, for the one it had read.
+    """
+    cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def intersect(a, b):
+    """
+    Ids of both sorted arrays, in order.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(a) * log2(len(b) + 1) < len(b):
+        # Look up the few ids of the small array in the large one
+        result = []
+        for x in a:
+            i = bisect_left(b, x)
+            if i < len(b) and b[i] == x:
+                result.append(x)
+        return result
+    return sorted(set(a).intersection(b))
+
+
+class FriendGraph:
+    def __init__(self):
+        self.friends = {}
+        self.generation = None
+        self.lock = threading.RLock()
+
+    def get(self, user_id):
+        return self.friends.get(user_id, ())
+
+    def add(self, user_id, friend_id):
+        with self.lock:
+            friends = self.friends.setdefault(user_id, array(TYPECODE))
+            i = bisect_left(friends, friend_id)
+            if i == len(friends) or friends[i] != friend_id:
+                friends.insert(i, friend_id)
+
+    def remove(self, user_id, friend_id):
+        with self.lock:
+            friends = self.friends.get(user_id)
+            if friends is None:
+                return
+            i = bisect_left(friends, friend_id)
+            if i < len(friends) and friends[i] == friend_id:
+                del friends[i]
+            if not friends:
+                del self.friends[user_id]
+
+    @staticmethod
+    def build(rows):
+        """
+        Arrays of the (user, friend) rows, sorted by user and friend.
+        """
+        friends = {}
+        current_id = None
+        for user_id, friend_id in rows:
+            if user_id != current_id:
+                current_id = user_id
+                current = friends[user_id] = array(TYPECODE)
+            current.append(friend_id)
+        return friends
+
+    def load(self, user_ids=None):
+        """
+        Load the friends of the profiles from the database, of all of them
+        by default.
+        """
+        rows = Friend.objects.order_by("user", "friend").values_list("user", "friend")
+        if user_ids is not None:
+            rows = rows.filter(user__in=user_ids)
+
+        # The log of the changes may be ahead of a replica
+        with use_primary():
+            friends = self.build(rows.iterator(chunk_size=10000))
+
+        with self.lock:
+            if user_ids is None:
+                self.friends = friends
+            else:
+                for user_id in user_ids:
+                    self.friends.pop(user_id, None)
+                self.friends.update(friends)
+
+    def sync(self):
+        """
+        Catch up with the changes of the other processes.
+        """
+        cache = get_cache()
+        generation = cache.get(GENERATION_KEY)
+        if generation is None:
+            start_log(cache)
+            generation = cache.get(GENERATION_KEY, 0)
+        elif generation == self.generation:
+            return
+
+        with self.lock:
+            if (
+                self.generation is None
+                or not 0 < generation - self.generation <= MAX_LOG
+            ):
+                self.load()
+                self.generation = generation
+                return
+
+            keys = [change_key(x) for x in range(self.generation + 1, generation + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) < len(keys):
+                self.load()
+            else:
+                self.load({x for ids in changes.values() for x in ids})
+            self.generation = generation
+
+    def mutual(self, user_id, other_id):
+        return intersect(self.get(user_id), self.get(other_id))
+
+    def path(self, source, target, max_hops):
+        """
+        Shortest chain of friends from source to target, as a list of ids
+        from source to target, or None if there is none within max_hops.
+        """
+        if source == target:
+            return [source]
+
+        # Parent of every visited id, on each side
+        parents = ({source: None}, {target: None})
+        frontiers = ([source], [target])
+        hops = 0
+        while hops < max_hops and frontiers[0] and frontiers[1]:
+            # Grow the smaller side
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            mine, theirs = parents[side], parents[1 - side]
+            frontier = []
+            meeting = None
+            for user_id in frontiers[side]:
+                for friend_id in self.get(user_id):
+                    if friend_id in mine:
+                        continue
+                    mine[friend_id] = user_id
+                    if friend_id in theirs:
+                        meeting = friend_id
+                        break
+                    frontier.append(friend_id)
+                if meeting is not None:
+                    break
+            hops += 1
+
+            if meeting is not None:
+                path = []
+                node = meeting
+                while node is not None:
+                    path.append(node)
+                    node = parents[0][node]
+                path.reverse()
+                node = parents[1][meeting]
+                while node is not None:
+                    path.append(node)
+                    node = parents[1][node]
+                return path
+
+            frontiers = (frontier, frontiers[1]) if side == 0 else (frontiers[0], frontier)
+
+        return None
+
+
+graph = FriendGraph()
+
+
+def get_graph():
+    graph.sync()
+    return graph
+
+
+def record_friends(added=(), removed=()):
+    """
+    After the commit, apply the (user, friend) rows to the index of this
+    process and log their users for the other processes.
+    """
+    def apply():
+        for user_id, friend_id in added:
+            graph.add(user_id, friend_id)
+        for user_id, friend_id in removed:
+            graph.remove(user_id, friend_id)
+
+        cache = get_cache()
+        start_log(cache)
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            # Evicted in between, the next sync reloads everything
+            return
+        user_ids = sorted({user_id for user_id, _ in [*added, *removed]})
+        cache.set(change_key(generation), user_ids, LOG_TIMEOUT)
+
+        with graph.lock:
+            if graph.generation == generation - 1:
+                # Nobody else changed the friends in between
+                graph.generation = generation
+
+    transaction.on_commit(apply)
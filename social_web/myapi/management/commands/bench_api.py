@@ -0,0 +1,123 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapi.bench import seed_graph, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every /api endpoint on a synthetic social graph, "
+        "in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=10000)
+        parser.add_argument(
+            "--degree", type=int, default=20, help="Mean number of friends."
+        )
+        parser.add_argument(
+            "--alpha", type=float, default=2.5, help="Power law exponent of the degree."
+        )
+        parser.add_argument(
+            "--hub-degree", type=int, default=1000,
+            help="Number of friends of the benchmark user.",
+        )
+        parser.add_argument(
+            "--messages", type=int, default=1000,
+            help="Length of the benchmark conversation.",
+        )
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--cold-cache", action="store_true",
+            help="Clear the cache before every request.",
+        )
+        parser.add_argument(
+            "--output", help="Write the JSON report to this file.",
+        )
+        parser.add_argument(
+            "--compare", help="JSON report of a previous run to compare with.",
+        )
+
+    def handle(self, *args, **options):
+        if options["hub_degree"] < 2 * (options["repeat"] + 1) + 1:
+            raise CommandError("--hub-degree must be above 2 * (--repeat + 1).")
+        if options["profiles"] <= options["hub_degree"]:
+            raise CommandError("--profiles must be above --hub-degree.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            graph = seed_graph(
+                profiles=options["profiles"],
+                degree=options["degree"],
+                alpha=options["alpha"],
+                hub_degree=options["hub_degree"],
+                messages=options["messages"],
+                reserve=options["repeat"] + 1,
+                seed=options["seed"],
+            )
+            results = run_benchmark(graph, options["repeat"], options["cold_cache"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "meta": {
+                "commit": self.get_commit(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": settings.DATABASES["default"]["ENGINE"],
+                # See myapi.bench.bench_settings
+                "settings": "prod: no DEBUG, no dev middleware",
+                **{
+                    key: options[key]
+                    for key in (
+                        "profiles", "degree", "alpha", "hub_degree",
+                        "messages", "repeat", "seed", "cold_cache",
+                    )
+                },
+            },
+            "endpoints": results,
+        }
+
+        data = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(data)
+        else:
+            self.stdout.write(data)
+
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                self.compare(json.load(file)["endpoints"], results)
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, old, new):
+        self.stderr.write(f"{'endpoint':32} {'p50 ms':>18} {'p99 ms':>18} {'queries':>10}")
+        for name, result in new.items():
+            before = old.get(name)
+            if before is None:
+                continue
+            self.stderr.write(
+                f"{name:32} "
+                f"{before['p50_ms']:>8} -> {result['p50_ms']:<8}"
+                f"{before['p99_ms']:>8} -> {result['p99_ms']:<8}"
+                f"{before['queries']:>4} -> {result['queries']:<4}"
+            )
@@ -0,0 +1,168 @@
+import http.client
+import json
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapi.bench import bench_settings, seed_graph, percentile
+from myapi.utils import create_jwt
+
+HOST = "127.0.0.1"
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of the friends and requests read paths under "
+        "uvicorn (ASGI, sync and async views) and the threaded WSGI server, "
+        "on a synthetic graph in a throwaway test database. The servers and "
+        "the clients run in this process, so compare the numbers with each "
+        "other rather than with a production deployment. Without DEBUG and "
+        "the dev middleware, as in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=2000)
+        parser.add_argument("--hub-degree", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument(
+            "--requests", type=int, default=400, help="Requests per endpoint and server."
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError("This benchmark needs uvicorn: pip install uvicorn")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        override = bench_settings()
+        override.enable()
+        try:
+            graph = seed_graph(
+                profiles=options["profiles"],
+                hub_degree=options["hub_degree"],
+                messages=10,
+                reserve=1,
+            )
+            cookie = f"jwt={create_jwt(graph.hub.user)}"
+            friend = graph.friends[0]
+            incoming = graph.incoming[0]
+
+            wsgi = ThreadedWSGIServer((HOST, free_port()), QuietHandler)
+            # Made under bench_settings, which they load their middleware from
+            wsgi.set_app(get_wsgi_application())
+            threading.Thread(target=wsgi.serve_forever, daemon=True).start()
+
+            asgi = uvicorn.Server(uvicorn.Config(
+                get_asgi_application(),
+                host=HOST,
+                port=free_port(),
+                log_level="warning",
+                lifespan="off",
+            ))
+            threading.Thread(target=asgi.run, daemon=True).start()
+            while not asgi.started:
+                time.sleep(0.05)
+
+            sync_paths = {
+                "friends-list": "/api/friends/?paginate=false",
+                "friends-detail": f"/api/friends/{friend}/",
+                "requests-list": "/api/requests/",
+                "requests-detail": f"/api/requests/{incoming}/",
+            }
+            async_paths = {
+                "friends-list": "/api/async/friends/",
+                "friends-detail": f"/api/async/friends/{friend}/",
+                "requests-list": "/api/async/requests/",
+                "requests-detail": f"/api/async/requests/{incoming}/",
+            }
+            runs = {
+                "wsgi-sync": (wsgi.server_address[1], sync_paths),
+                "asgi-sync": (asgi.config.port, sync_paths),
+                "asgi-async": (asgi.config.port, async_paths),
+            }
+
+            results = {}
+            for run, (port, paths) in runs.items():
+                results[run] = {
+                    name: self.hammer(port, path, cookie, options)
+                    for name, path in paths.items()
+                }
+
+            asgi.should_exit = True
+            wsgi.shutdown()
+        finally:
+            override.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        data = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(data)
+        else:
+            self.stdout.write(data)
+
+        self.stderr.write("Without DEBUG and the dev middleware (myapi.bench.bench_settings)")
+        self.stderr.write(f"{'endpoint':18}" + "".join(f"{x + ' rps':>16}" for x in runs))
+        for name in sync_paths:
+            self.stderr.write(
+                f"{name:18}" + "".join(f"{results[x][name]['rps']:>16}" for x in runs)
+            )
+
+    @staticmethod
+    def hammer(port, path, cookie, options):
+        """
+        Send the requests from a pool of keep-alive clients.
+        """
+        concurrency = options["concurrency"]
+        count = options["requests"] // concurrency
+
+        def client(_):
+            conn = http.client.HTTPConnection(HOST, port, timeout=30)
+            timings = []
+            errors = 0
+            for _ in range(count):
+                start = time.perf_counter()
+                conn.request("GET", path, headers={"Cookie": cookie})
+                response = conn.getresponse()
+                response.read()
+                timings.append(time.perf_counter() - start)
+                errors += response.status >= 400
+            conn.close()
+            return timings, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(client, range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        timings = [x for result in results for x in result[0]]
+        return {
+            "rps": round(len(timings) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "p99_ms": round(percentile(timings, 99) * 1000, 3),
+            "errors": sum(result[1] for result in results),
+        }
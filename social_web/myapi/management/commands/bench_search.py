@@ -0,0 +1,89 @@
+import json
+import random
+import string
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapi.bench import BATCH_SIZE, percentile
+from users_site.models import Profile
+from users_site.search import index_profiles, search_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the latency of the profile search on random usernames, "
+        "in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=1000000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.perf_counter()
+            names = self.seed(rng, options["profiles"])
+            seed_time = time.perf_counter() - start
+
+            queries = {
+                "exact": [rng.choice(names) for _ in range(options["queries"])],
+                "prefix": [rng.choice(names)[:3] for _ in range(options["queries"])],
+                "fuzzy": [self.typo(rng, rng.choice(names)) for _ in range(options["queries"])],
+            }
+            report = {
+                "profiles": options["profiles"],
+                "seed_s": round(seed_time, 1),
+                **{kind: self.measure(values) for kind, values in queries.items()},
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def seed(rng, count):
+        """
+        Profiles named like "word_word12", without users, a batch at a time.
+        """
+        words = [
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+            for _ in range(5000)
+        ]
+        names = [
+            f"{rng.choice(words)}_{rng.choice(words)}{rng.randrange(100)}"
+            for _ in range(count)
+        ]
+        for start in range(0, count, BATCH_SIZE):
+            # With their ids, on the databases which return them
+            profiles = Profile.objects.bulk_create(
+                [Profile(username=x) for x in names[start:start + BATCH_SIZE]]
+            )
+            index_profiles(profiles)
+        return names
+
+    @staticmethod
+    def typo(rng, name):
+        i = rng.randrange(len(name))
+        return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:] + "q"
+
+    @staticmethod
+    def measure(values):
+        timings = []
+        for query in values:
+            start = time.perf_counter()
+            search_profiles(query)
+            timings.append(time.perf_counter() - start)
+        return {
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        }
@@ -0,0 +1,106 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROFILES = ["dev", "prod"]
+
+
+def run_child(requests):
+    """
+    Measure this process, with the settings of its DJANGO_ENV: the time
+    to set Django up and load the URLs and the middleware, then the
+    latency of a request without and with queries.
+    """
+    start = time.perf_counter()
+    import django
+    from django.core.wsgi import get_wsgi_application
+
+    django.setup()
+    get_wsgi_application()
+    import social_web.urls  # noqa: F401
+    setup_time = time.perf_counter() - start
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+
+    from myapi.utils import create_jwt
+    from users_site.models import Profile
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    # A database left by a killed run is replaced
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = User.objects.create_user(username="bench", password="Password123")
+        Profile.objects.create(user=user, username="bench")
+
+        client = Client()
+        client.cookies["jwt"] = create_jwt(user)
+
+        def measure(url, data=None):
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(url, data)
+                timings.append(time.perf_counter() - start)
+            return round(statistics.median(timings) * 10 ** 6, 1)
+
+        result = {
+            "setup_ms": round(setup_time * 1000, 1),
+            "api_root_us": measure(reverse("api-root")),
+            "search_us": measure(reverse("profile-search"), {"q": "bench"}),
+            "queries_logged": len(connection.queries_log),
+            "middleware": len(settings.MIDDLEWARE),
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    sys.stdout.write(json.dumps(result))
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the startup time and the per-request overhead of every "
+        "settings profile, each in a new process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--profiles", nargs="+", default=PROFILES, choices=PROFILES)
+
+    def handle(self, *args, **options):
+        code = (
+            "from myapi.management.commands.bench_startup import run_child; "
+            f"run_child({options['requests']})"
+        )
+        report = {}
+        for profile in options["profiles"]:
+            env = {
+                **os.environ,
+                "DJANGO_ENV": profile,
+                "DJANGO_SETTINGS_MODULE": "social_web.settings",
+            }
+            env.setdefault("DJANGO_SECRET_KEY", "bench-" + "x" * 50)
+            env.setdefault("METRICS_TOKEN", "bench")
+
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if process.returncode:
+                raise CommandError(f"{profile}: {process.stderr}")
+            report[profile] = {
+                "process_s": round(time.perf_counter() - start, 2),
+                **json.loads(process.stdout),
+            }
+
+        self.stdout.write(json.dumps(report, indent=2))
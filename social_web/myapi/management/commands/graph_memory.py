@@ -0,0 +1,91 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from myapi.bench import percentile
+from myapi.graph import FriendGraph
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the memory of the friends index and the latency of its "
+        "queries, on a random graph or on the friends of the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--edges", type=int, default=1000000)
+        parser.add_argument("--profiles", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=1000)
+        parser.add_argument("--max-hops", type=int, default=6)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--from-db", action="store_true",
+            help="Load the friends of the database instead of a random graph.",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        graph = FriendGraph()
+
+        start = time.perf_counter()
+        if options["from_db"]:
+            tracemalloc.start()
+            graph.load()
+        else:
+            rows = self.random_rows(rng, options["edges"], options["profiles"])
+            tracemalloc.start()
+            graph.friends = graph.build(divmod(x, 1 << 32) for x in rows)
+            del rows
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        load_time = time.perf_counter() - start
+
+        ids = list(graph.friends)
+        edges = sum(len(x) for x in graph.friends.values()) // 2
+        pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(options["queries"])]
+
+        report = {
+            "profiles": len(ids),
+            "edges": edges,
+            "memory_mb": round(size / 2 ** 20, 1),
+            "peak_memory_mb": round(peak / 2 ** 20, 1),
+            "bytes_per_edge": round(size / max(edges, 1), 1),
+            "load_s": round(load_time, 2),
+            "mutual": self.measure(lambda a, b: graph.mutual(a, b), pairs),
+            "path": self.measure(
+                lambda a, b: graph.path(a, b, options["max_hops"]),
+                pairs[:max(1, len(pairs) // 10)],
+            ),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def random_rows(rng, edges, profiles):
+        """
+        Both rows of every random friendship, encoded as user << 32 | friend
+        and sorted.
+        """
+        rows = array("q")
+        for _ in range(edges):
+            a, b = rng.randrange(1, profiles + 1), rng.randrange(1, profiles + 1)
+            if a != b:
+                rows.append(a << 32 | b)
+                rows.append(b << 32 | a)
+        return array("q", sorted(set(rows)))
+
+    @staticmethod
+    def measure(query, pairs):
+        timings = []
+        for a, b in pairs:
+            start = time.perf_counter()
+            query(a, b)
+            timings.append(time.perf_counter() - start)
+        return {
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        }
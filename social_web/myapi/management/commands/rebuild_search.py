@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from users_site.search import BATCH_SIZE, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Index the usernames of every profile for the search again, "
+        "a batch of profiles at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=BATCH_SIZE,
+            help="Number of profiles indexed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        done = 0
+        for done in rebuild_search_index(options["batch_size"]):
+            self.stdout.write(f"{done} profiles")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {done} profiles"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from myapi.suggestions import BATCH_SIZE, rebuild_suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the mutual friend counts of the suggestions from scratch, "
+        "a batch of users at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=BATCH_SIZE,
+            help="Number of users rebuilt per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        done = 0
+        for done in rebuild_suggestions(options["batch_size"]):
+            self.stdout.write(f"{done} users")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the suggestions of {done} users"))
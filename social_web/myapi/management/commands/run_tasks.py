@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from myapi.tasks import work
+
+
+class Command(BaseCommand):
+    help = "Run the background tasks as they are queued."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Stop once no task is due.",
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=1.0,
+            help="Seconds to wait when no task is due.",
+        )
+
+    def handle(self, *args, **options):
+        done = work(once=options["once"], sleep=options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Ran {done} tasks"))
@@ -0,0 +1,233 @@
+"""
+Latency and SQL metrics of the requests, by view, for Prometheus.
+
+``MetricsMiddleware`` times every request, and an execute wrapper, put
+on every database connection once as it connects, counts and times the
+queries of the request. The requests are labelled with their DRF viewset and action, e.g.
+``FriendViewSet.list_message``, and go to three histograms: duration,
+time spent in the database and number of queries. ``metrics`` renders
+them in the Prometheus text format, at ``/metrics``.
+
+The middleware runs in both modes, so the ASGI handler does not put the
+whole chain on a thread. The view of the request is known from its
+``resolver_match``, once it has its response.
+
+The body of a streaming response, e.g. of ``export_message``, is made
+after the middleware returns, so its requests are observed when the
+stream is done, with the queries run for it.
+
+The histograms are those of this process; Prometheus scrapes every
+process and sums them.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNMATCHED = "unmatched"
+
+# Queries of the current request: [count, duration]
+current_queries = ContextVar("myapi_queries", default=None)
+# Of the three histograms, which are observed together
+lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # Label: [count of every bucket and +Inf], sum
+        self.series = {}
+
+    def observe(self, label, value):
+        """
+        Count the value, under the lock.
+        """
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with lock:
+            series = {x: (list(counts), total) for x, (counts, total) in self.series.items()}
+        for label, (counts, total) in sorted(series.items()):
+            view = f'view="{label}"'
+            count = 0
+            for bound, value in zip([*self.buckets, "+Inf"], counts):
+                count += value
+                lines.append(f'{self.name}_bucket{{{view},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{view}}} {total}")
+            lines.append(f"{self.name}_count{{{view}}} {count}")
+        return lines
+
+
+request_duration = Histogram(
+    "myapi_request_duration_seconds",
+    "Duration of the requests, by view.",
+    DURATION_BUCKETS,
+)
+db_duration = Histogram(
+    "myapi_db_duration_seconds",
+    "Time of the requests in the database, by view.",
+    DURATION_BUCKETS,
+)
+db_queries = Histogram(
+    "myapi_db_queries",
+    "Number of SQL queries of the requests, by view.",
+    QUERY_BUCKETS,
+)
+HISTOGRAMS = [request_duration, db_duration, db_queries]
+
+
+def get_label(view_func, method):
+    """
+    Viewset and action of a DRF view, or the name of a plain view.
+    """
+    cls = getattr(view_func, "cls", None)
+    actions = getattr(view_func, "actions", None)
+    if cls is not None and actions:
+        return f"{cls.__name__}.{actions.get(method.lower(), method.lower())}"
+    if cls is not None:
+        return f"{cls.__name__}.{method.lower()}"
+    return getattr(view_func, "__name__", UNMATCHED)
+
+
+def time_query(execute, sql, params, many, context):
+    queries = current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+def install_wrapper(sender, connection, **kwargs):
+    """
+    Put the wrapper on a new connection, which keeps it when it connects
+    again.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def get_request_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return UNMATCHED
+    return get_label(match.func, request.method)
+
+
+@sync_and_async_middleware
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = [0, 0.0]
+        token = current_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.finish(request, response, start, queries)
+
+    async def __acall__(self, request):
+        queries = [0, 0.0]
+        token = current_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.finish(request, response, start, queries)
+
+    def finish(self, request, response, start, queries):
+        label = get_request_label(request)
+        if response.streaming:
+            stream = self.astream if response.is_async else self.stream
+            response.streaming_content = stream(
+                response.streaming_content, label, start, queries
+            )
+        else:
+            self.observe(label, start, queries)
+        return response
+
+    @staticmethod
+    def observe(label, start, queries):
+        duration = time.perf_counter() - start
+        with lock:
+            request_duration.observe(label, duration)
+            db_duration.observe(label, queries[1])
+            db_queries.observe(label, queries[0])
+
+    def stream(self, content, label, start, queries):
+        """
+        Chunks of the content, counting their queries, then observe the
+        request, also when the stream is closed before its end.
+        """
+        content = iter(content)
+        try:
+            while True:
+                token = current_queries.set(queries)
+                try:
+                    chunk = next(content)
+                except StopIteration:
+                    return
+                finally:
+                    current_queries.reset(token)
+                yield chunk
+        finally:
+            self.observe(label, start, queries)
+
+    async def astream(self, content, label, start, queries):
+        content = aiter(content)
+        try:
+            while True:
+                token = current_queries.set(queries)
+                try:
+                    chunk = await anext(content)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    current_queries.reset(token)
+                yield chunk
+        finally:
+            self.observe(label, start, queries)
+
+
+def metrics(request):
+    """
+    The histograms, in the Prometheus text format. With
+    ``settings.MYAPI_METRICS_TOKEN``, only for ``Authorization: Bearer <token>``.
+    """
+    token = getattr(settings, "MYAPI_METRICS_TOKEN", None)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+
+    lines = [line for histogram in HISTOGRAMS for line in histogram.render()]
+    return HttpResponse(
+        "\n".join(lines) + "\n",
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
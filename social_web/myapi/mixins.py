@@ -0,0 +1,85 @@
+import functools
+import zlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+
+from myapi.authentication import JWTUser
+from myapi.cache import get_version
+from users_site.models import Profile
+
+
+def get_current_profile(request):
+    """
+    Get the profile of the user of the request, once per request.
+    """
+    # Keep it on the Django request, so every DRF request wrapping it
+    # and every middleware share the same lookup.
+    request = getattr(request, "_request", request)
+    if not hasattr(request, "_profile"):
+        user = getattr(request, "user", None)
+        profile = None
+        if user is not None and user.is_authenticated:
+            profile = Profile.objects.select_related("user").filter(
+                user_id=user.id,
+            ).first()
+        if profile is not None and isinstance(user, JWTUser):
+            # Spare the lazy User lookup of the JWT user
+            user.__dict__["user"] = profile.user
+        request._profile = profile
+
+    if request._profile is None:
+        raise AuthenticationFailed("Unauthenticated")
+    return request._profile
+
+
+class HasProfile(BasePermission):
+    """
+    Allow users with a profile only.
+    """
+
+    def has_permission(self, request, view):
+        return get_current_profile(request) is not None
+
+
+class CurrentProfileMixin:
+    permission_classes = [HasProfile, ]
+
+    def get_profile(self):
+        return get_current_profile(self.request)
+
+
+def conditional(kind):
+    """
+    Answer a view of the data of the profile with a strong ETag taken
+    from the version of its cache entry, and with a 304 when the client
+    already has it.
+
+    The ETag covers the query string and the format, which change the
+    body of the same data. There is no Last-Modified: the dates of HTTP
+    are to the second, so a client asking If-Modified-Since would keep a
+    body changed in the same second.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            profile = self.get_profile()
+            version = get_version(kind, profile)
+            variant = zlib.crc32(
+                f"{request.accepted_renderer.format}?{request.META.get('QUERY_STRING', '')}".encode()
+            )
+            etag = quote_etag(f"{kind}-{profile.pk}-{version:x}-{variant:x}")
+
+            response = get_conditional_response(request._request, etag=etag)
+            if response is None:
+                response = view(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response["ETag"] = etag
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,30 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a conversation, newest messages first.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class FriendCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the friends of a user, by friend id.
+    """
+    ordering = "friend_id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+
+class SearchPagination(PageNumberPagination):
+    """
+    Pages of the ranked results of a search.
+    """
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,197 @@
+"""
+Profiles of a sample of the live requests to /api/.
+
+``ProfilingMiddleware`` profiles a fraction of the requests, the rate, with
+``sys.setprofile``: the time of every stack of Python and C calls, so the
+calls of a request of a few milliseconds are all there. Every profile is
+written to ``DIR`` of ``settings.MYAPI_PROFILING`` as two files: the
+stacks, collapsed in the format of flamegraph.pl and speedscope, with their
+time in microseconds, and a JSON summary of the request: its view, e.g.
+``FriendViewSet.create_message``, its duration and its queries by shape.
+Only the last ``KEEP`` profiles are kept.
+
+``sys.setprofile`` sees the calls of its thread only. Under ASGI the
+middleware runs on the event loop and the views on other threads, so it
+passes the requests through; under WSGI, the requests of the coroutine
+views, e.g. of ``/api/async/``, are not written either.
+
+The rate is 0, off, unless ``RATE`` says otherwise; the admins change it
+at runtime with ``/api/profiling``. It is kept in the cache, so shared by
+the processes with Redis, and read again by every process every
+``REFRESH`` seconds.
+"""
+import json
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from myapi.cache import get_cache
+from myapi.metrics import get_request_label
+from myapi.querycheck import QueryRecorder
+
+RATE_KEY = "myapi:profiling:rate"
+SUFFIX = ".folded"
+
+# Rate of this process, until it is read again from the cache
+state = {"rate": 0.0, "expires": 0.0}
+
+
+def get_config():
+    return {
+        "RATE": 0.0,
+        "DIR": Path(settings.BASE_DIR) / "profiles",
+        "KEEP": 100,
+        "REFRESH": 5,
+        **getattr(settings, "MYAPI_PROFILING", {}),
+    }
+
+
+def get_rate():
+    now = time.monotonic()
+    if now >= state["expires"]:
+        config = get_config()
+        state["rate"] = get_cache().get(RATE_KEY, config["RATE"])
+        state["expires"] = now + config["REFRESH"]
+    return state["rate"]
+
+
+def set_rate(rate):
+    """
+    Profile this fraction of the requests, in every process.
+    """
+    get_cache().set(RATE_KEY, rate, None)
+    state["rate"] = rate
+    state["expires"] = time.monotonic() + get_config()["REFRESH"]
+
+
+def frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+def function_name(function):
+    module = getattr(function, "__module__", None)
+    if module is None:
+        module = type(getattr(function, "__self__", None)).__module__
+    return f"{module}:{function.__qualname__}"
+
+
+class StackProfiler:
+    """
+    Self time of every stack of the calls of this thread, in nanoseconds.
+    """
+    def __init__(self):
+        self.stacks = Counter()
+        # Stack of the current call, of every call under way
+        self.path = [()]
+        self.last = None
+
+    def __call__(self, frame, event, arg):
+        now = time.perf_counter_ns()
+        self.stacks[self.path[-1]] += now - self.last
+        if event == "call":
+            self.path.append(self.path[-1] + (frame_name(frame),))
+        elif event == "c_call":
+            self.path.append(self.path[-1] + (function_name(arg),))
+        elif len(self.path) > 1:
+            # A return of a call started before the profile has no stack
+            self.path.pop()
+        self.last = time.perf_counter_ns()
+
+    def __enter__(self):
+        self.last = time.perf_counter_ns()
+        sys.setprofile(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.setprofile(None)
+
+    def collapsed(self, root):
+        """
+        Lines of the stacks, under root, and their microseconds.
+        """
+        return [
+            f"{';'.join((root, *stack))} {round(ns / 1000)}"
+            for stack, ns in sorted(self.stacks.items())
+            if ns >= 500
+        ]
+
+
+def summarize_queries(queries):
+    shapes = {}
+    for query in queries:
+        shape = shapes.setdefault(query.shape, {"sql": query.shape, "count": 0, "ms": 0.0})
+        shape["count"] += 1
+        shape["ms"] += query.duration * 1000
+    return {
+        "count": len(queries),
+        "ms": round(sum(x.duration for x in queries) * 1000, 3),
+        "shapes": [
+            {**x, "ms": round(x["ms"], 3)}
+            for x in sorted(shapes.values(), key=lambda x: -x["ms"])[:10]
+        ],
+    }
+
+
+def write_profile(request, response, profiler, recorder, duration):
+    config = get_config()
+    directory = Path(config["DIR"])
+    directory.mkdir(parents=True, exist_ok=True)
+
+    label = get_request_label(request)
+    name = f"{datetime.now():%Y%m%dT%H%M%S.%f}-{label}-{uuid.uuid4().hex[:8]}"
+    (directory / f"{name}{SUFFIX}").write_text("\n".join(profiler.collapsed(label)) + "\n")
+    summary = {
+        "view": label,
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "ms": round(duration * 1000, 3),
+        "queries": summarize_queries(recorder.queries),
+    }
+    (directory / f"{name}.json").write_text(json.dumps(summary, indent=2))
+
+    # The names start with the time
+    profiles = sorted(directory.glob(f"*{SUFFIX}"))
+    for path in profiles[:max(0, len(profiles) - config["KEEP"])]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".json").unlink(missing_ok=True)
+
+
+def list_profiles():
+    directory = Path(get_config()["DIR"])
+    return sorted((x.stem for x in directory.glob(f"*{SUFFIX}")), reverse=True)
+
+
+@sync_and_async_middleware
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if not request.path.startswith("/api/"):
+            return self.get_response(request)
+        rate = get_rate()
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with QueryRecorder(stacks=False) as recorder:
+            with StackProfiler() as profiler:
+                response = self.get_response(request)
+        # The stacks of a coroutine view would be empty
+        match = getattr(request, "resolver_match", None)
+        if match is None or not iscoroutinefunction(match.func):
+            write_profile(request, response, profiler, recorder, time.perf_counter() - start)
+        return response
@@ -0,0 +1,119 @@
+"""
+Publish/subscribe of the new messages of a conversation.
+
+``create_message`` publishes every message once its transaction is
+committed, and ``myapi.websockets`` relays them to the sockets of the
+conversation. The backend is chosen by ``settings.MYAPI_PUBSUB``:
+``LocalPubSub`` delivers within this process only, ``RedisPubSub`` goes
+through a Redis server and reaches every process. The other keys, as
+for ``CACHES``, are the arguments of the backend, e.g. ``LOCATION``.
+
+The messages are published as JSON text, so they are serialized once
+whatever the number of subscribers.
+"""
+import asyncio
+import contextlib
+import functools
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from myapi.serializers import MessageListSerializer
+
+
+def conversation_channel(conversation):
+    return f"myapi:conversation:{conversation}"
+
+
+class LocalPubSub:
+    """
+    Fan out to the subscribers of this process, from any thread.
+
+    Every subscriber has a bounded queue; when it does not keep up, its
+    oldest messages are dropped.
+    """
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, data):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self.deliver, queue, data)
+
+    @staticmethod
+    def deliver(queue, data):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.max_queue))
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            yield subscriber[1].get
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+class RedisPubSub:
+    """
+    Fan out through the PUBLISH/SUBSCRIBE commands of a Redis server.
+    """
+    def __init__(self, location):
+        import redis
+        import redis.asyncio
+
+        self.location = location
+        self.client = redis.Redis.from_url(location)
+        self.async_client = redis.asyncio.Redis.from_url(location)
+
+    def publish(self, channel, data):
+        self.client.publish(channel, data)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        pubsub = self.async_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+
+        async def get():
+            while True:
+                message = await pubsub.get_message(timeout=None)
+                if message is not None:
+                    return message["data"].decode()
+
+        try:
+            yield get
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+
+
+@functools.cache
+def get_pubsub():
+    config = dict(settings.MYAPI_PUBSUB)
+    backend = import_string(config.pop("BACKEND"))
+    return backend(**{key.lower(): value for key, value in config.items()})
+
+
+def publish_message(message):
+    """
+    Publish the message to its conversation after the commit.
+
+    A failure of the broker is logged and does not fail the request: the
+    message is saved and can be read with ``list_message``.
+    """
+    channel = conversation_channel(message.conversation)
+    data = JSONRenderer().render(MessageListSerializer(message).data).decode()
+    transaction.on_commit(lambda: get_pubsub().publish(channel, data), robust=True)
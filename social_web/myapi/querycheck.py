@@ -0,0 +1,156 @@
+"""
+Detection of the N+1 and slow queries.
+
+``QueryRecorder`` records the queries run in its block, on every
+database connection, with their duration and the frames of the project
+which ran them. Two queries have the same shape when their SQL is the
+same but for the number of values of their IN lists, so a lookup in a
+loop, e.g. of a related object which is not in ``select_related``, shows
+up as one shape repeated for every row.
+
+``QueryCheckMixin`` fails a test on the shapes repeated more than
+``MAX_REPEATS`` times and the queries slower than ``SLOW_QUERY`` seconds
+of ``settings.MYAPI_QUERY_CHECK``; ``QueryCheckMiddleware`` logs them for
+every request, in development.
+"""
+import contextlib
+import logging
+import re
+import time
+import traceback
+from collections import Counter
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections
+
+from myapi import metrics
+
+IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+
+logger = logging.getLogger("myapi.queries")
+
+
+def get_limits(max_repeats=None, slow_query=None):
+    config = getattr(settings, "MYAPI_QUERY_CHECK", {})
+    return (
+        config.get("MAX_REPEATS", 2) if max_repeats is None else max_repeats,
+        config.get("SLOW_QUERY", 0.1) if slow_query is None else slow_query,
+    )
+
+
+def project_stack():
+    """
+    Frames of the project code, innermost last, without the execute
+    wrappers.
+    """
+    root = str(settings.BASE_DIR)
+    return [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(root)
+        and "site-packages" not in frame.filename
+        and frame.filename not in (__file__, metrics.__file__)
+    ]
+
+
+@dataclass
+class Query:
+    sql: str
+    duration: float
+    stack: list
+
+    @property
+    def shape(self):
+        return IN_LIST.sub("IN (...)", self.sql)
+
+
+class QueryRecorder:
+    def __init__(self, stacks=True):
+        self.queries = []
+        self.stacks = stacks
+        self.exit_stack = contextlib.ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                Query(
+                    sql,
+                    time.perf_counter() - start,
+                    project_stack() if self.stacks else [],
+                )
+            )
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.exit_stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.exit_stack.__exit__(*exc_info)
+
+    def repeated(self, max_repeats):
+        """
+        First query of every shape run more than max_repeats times, with
+        the number of times.
+        """
+        counts = Counter(x.shape for x in self.queries)
+        first = {}
+        for query in self.queries:
+            if counts[query.shape] > max_repeats:
+                first.setdefault(query.shape, query)
+        return [(query, counts[shape]) for shape, query in first.items()]
+
+    def slow(self, slow_query):
+        return [x for x in self.queries if x.duration > slow_query]
+
+    def problems(self, max_repeats=None, slow_query=None):
+        """
+        Description of the N+1 and slow queries, one per item.
+        """
+        max_repeats, slow_query = get_limits(max_repeats, slow_query)
+        return [
+            *(
+                describe(query, f"N+1: run {count} times")
+                for query, count in self.repeated(max_repeats)
+            ),
+            *(
+                describe(query, f"slow: {query.duration * 1000:.1f} ms")
+                for query in self.slow(slow_query)
+            ),
+        ]
+
+
+def describe(query, problem):
+    stack = "".join(traceback.format_list(query.stack[-5:]))
+    return f"{problem}\n    {query.shape}\n{stack}"
+
+
+class QueryCheckMixin:
+    """
+    Test case assertion of no N+1 and no slow query.
+    """
+    @contextlib.contextmanager
+    def assertQueryCheck(self, max_repeats=None, slow_query=None):
+        with QueryRecorder() as recorder:
+            yield recorder
+        problems = recorder.problems(max_repeats, slow_query)
+        if problems:
+            self.fail("\n".join(problems))
+
+
+class QueryCheckMiddleware:
+    """
+    Log the N+1 and slow queries of every request, as warnings.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        for problem in recorder.problems():
+            logger.warning("%s %s: %s", request.method, request.path, problem)
+        return response
@@ -0,0 +1,140 @@
+"""
+Routing of the reads to the replicas of the database.
+
+``ReplicaRouter`` sends the reads to one of ``settings.MYAPI_REPLICAS``,
+chosen once per request by ``ReplicaMiddleware``, and the writes to the
+primary, ``default``. Without replicas, everything goes to the primary.
+
+A replica lags behind the primary, so a user who has just written reads
+from the primary for ``settings.MYAPI_REPLICA_PIN`` seconds: who has just
+accepted a request sees the friendship. The pin is kept in the cache
+under the id of the JWT user, or in a cookie for the other clients.
+Whatever must not be stale, like the data put in the cache, is read in
+``myapi.db.use_primary()``.
+"""
+import random
+
+import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.authentication import get_authorization_header
+
+from myapi.cache import get_cache
+from myapi.db import replica
+from myapi.utils import decode_jwt
+
+PIN_COOKIE = "myapi_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def pin_key(user_id):
+    return f"myapi:pin:{user_id}"
+
+
+def get_replicas():
+    return getattr(settings, "MYAPI_REPLICAS", [])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def get_user_id(request):
+    """
+    Id of the user of the JWT of the request, if any, without the database.
+    """
+    header = get_authorization_header(request).split()
+    if len(header) == 2 and header[0].lower() == b"bearer":
+        token = header[1].decode("latin1")
+    else:
+        token = request.COOKIES.get("jwt")
+    if not token:
+        return None
+    try:
+        return decode_jwt(token)["id"]
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+
+
+@sync_and_async_middleware
+class ReplicaMiddleware:
+    """
+    Pick the replica of the reads of the request, unless it writes or
+    its user wrote in the last ``MYAPI_REPLICA_PIN`` seconds.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        replicas = get_replicas()
+        if not replicas:
+            return self.get_response(request)
+
+        user_id = get_user_id(request)
+        pinned = self.is_pinned(request) or (
+            user_id is not None and get_cache().get(pin_key(user_id))
+        )
+        token = replica.set(None if pinned else random.choice(replicas))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica.reset(token)
+
+        if request.method not in SAFE_METHODS:
+            if user_id is not None:
+                get_cache().set(pin_key(user_id), True, settings.MYAPI_REPLICA_PIN)
+            else:
+                self.pin_cookie(response)
+        return response
+
+    async def __acall__(self, request):
+        replicas = get_replicas()
+        if not replicas:
+            return await self.get_response(request)
+
+        user_id = get_user_id(request)
+        pinned = self.is_pinned(request) or (
+            user_id is not None and await get_cache().aget(pin_key(user_id))
+        )
+        # Copied with the context to the threads of the sync views
+        token = replica.set(None if pinned else random.choice(replicas))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica.reset(token)
+
+        if request.method not in SAFE_METHODS:
+            if user_id is not None:
+                await get_cache().aset(pin_key(user_id), True, settings.MYAPI_REPLICA_PIN)
+            else:
+                self.pin_cookie(response)
+        return response
+
+    @staticmethod
+    def is_pinned(request):
+        """
+        Whether the request goes to the primary, without the cache.
+        """
+        return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+    @staticmethod
+    def pin_cookie(response):
+        pin = settings.MYAPI_REPLICA_PIN
+        response.set_cookie(PIN_COOKIE, "1", max_age=pin, httponly=True)
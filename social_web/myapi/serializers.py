@@ -1,12 +1,11 @@
-import datetime
-
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
 
-from users_site.models import Profile, FriendRequest, Friend
+from myapi.tasks import emit
+from users_site.models import Profile, FriendRequest, Message
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -45,47 +44,42 @@ class ProfileSerializer(serializers.ModelSerializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
-    # user = serializers.IntegerField(required=False)
-    # friend = serializers.IntegerField(required=False)
-    messages = serializers.CharField()
+    messages = serializers.CharField(source="text")
 
     class Meta:
-        model = Friend
+        model = Message
         fields = [
-            # "user",
-            # "friend",
             "messages",
         ]
 
     def create(self, validated_data):
-        p_user = validated_data['user']
-        p_friend = validated_data['friend']
-
-        # print(type(user), type(friend))
-
-        messages = validated_data.pop('messages')
-
-        user = Friend.objects.filter(
-            user=p_user,
-            friend=p_friend,
-        ).first()
-
-        # print(user.message)
-
-        friend = Friend.objects.filter(
-            user=p_friend,
-            friend=p_user,
-        ).first()
+        user = validated_data["user"]
+        friend = validated_data["friend"]
+
+        message = Message.objects.create(
+            conversation=Message.conversation_key(user, friend),
+            sender=user,
+            text=validated_data["text"],
+        )
+        emit(
+            "messages.created",
+            {"id": message.id, "sender": user.id, "recipient": friend.id},
+        )
+        return message
 
-        message = f"{datetime.datetime.now().strftime('%Y.%m.%d|%H:%M')}|{user.user}: {messages}\n"
 
-        user.message += message
-        user.save()
+class MessageListSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source="sender.username")
 
-        friend.message += message
-        friend.save()
-
-        return message
+    class Meta:
+        model = Message
+        fields = [
+            "id",
+            "sender",
+            "username",
+            "text",
+            "created_at",
+        ]
 
 
 class FriendSerializer(serializers.ModelSerializer):
@@ -118,6 +112,44 @@ class RequestDetailSerializer(serializers.Serializer):
         ]
 
 
+class BulkRequestSerializer(serializers.Serializer):
+    max_length = 500
+
+    usernames = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        required=False,
+        default=list,
+        max_length=max_length,
+    )
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        default=list,
+        max_length=max_length,
+    )
+
+    def validate(self, attrs):
+        if not attrs["usernames"] and not attrs["ids"]:
+            raise serializers.ValidationError("Give some usernames or ids.")
+        if len(attrs["usernames"]) + len(attrs["ids"]) > self.max_length:
+            raise serializers.ValidationError(f"Give at most {self.max_length} users.")
+        return attrs
+
+
+class BulkAnswerSerializer(RequestDetailSerializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=BulkRequestSerializer.max_length,
+    )
+
+    class Meta:
+        fields = [
+            "ids",
+            "choice",
+        ]
+
+
 class LoginSerializer(serializers.ModelSerializer):
     username = serializers.CharField(required=True)
     password = serializers.CharField(required=True)
@@ -0,0 +1,128 @@
+"""
+"People you may know": the users who share the most friends with a user.
+
+The count of mutual friends of every pair of users with at least one in
+common is kept in ``FriendSuggestion``. When ``friend`` joins or leaves
+the friends of ``user``, only the pairs of one of them change, so the
+background task of the "friends.added" and "friends.removed" events
+counts those again, off the requests which wrote the friends. Reading
+the suggestions of a user is one range of the rank index.
+"""
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from myapi.tasks import on
+from users_site.models import Friend, FriendSuggestion, Relationship
+
+BATCH_SIZE = 500
+
+
+def batches(values, size=BATCH_SIZE):
+    values = iter(values)
+    while batch := list(islice(values, size)):
+        yield batch
+
+
+def get_suggestions(me, limit):
+    """
+    Get the users with the most friends in common with the user, without
+    the friends of the user and the users with a pending request.
+    """
+    return FriendSuggestion.objects.select_related("candidate").filter(
+        user=me,
+    ).exclude(
+        candidate__in=Relationship.objects.filter(user=me).values("other"),
+    ).order_by("-mutual", "candidate")[:limit]
+
+
+def count_mutual(user_ids, mirror=False):
+    """
+    Insert the rows of the users, computed from the friends, and with
+    mirror the rows of the other users with them.
+    """
+    # Two hops: user -> friend -> candidate
+    counts = Friend.objects.filter(
+        user__in=user_ids,
+    ).annotate(
+        candidate=F("friend__user_friends__friend"),
+    ).exclude(
+        candidate=F("user"),
+    ).values("user", "candidate").annotate(mutual=Count("*")).order_by()
+
+    rows = (
+        FriendSuggestion(user_id=user, candidate_id=candidate, mutual=x["mutual"])
+        for x in counts.iterator(chunk_size=BATCH_SIZE * 10)
+        for user, candidate in (
+            [(x["user"], x["candidate"]), (x["candidate"], x["user"])]
+            if mirror else [(x["user"], x["candidate"])]
+        )
+    )
+    for chunk in batches(rows, BATCH_SIZE * 10):
+        # A pair of two of the users comes from both of them
+        FriendSuggestion.objects.bulk_create(chunk, ignore_conflicts=mirror)
+
+
+def rebuild_user_suggestions(user_ids):
+    """
+    Compute the counts of some users only, e.g. after a bulk import.
+    """
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user__in=user_ids).delete()
+        count_mutual(user_ids)
+
+
+def refresh_suggestions(user_ids, batch_size=BATCH_SIZE):
+    """
+    Count again every pair of one of the users, both ways, batch_size
+    users at a time. Unlike moving the counts by one, the same when run
+    twice.
+    """
+    for batch in batches(sorted(set(user_ids)), batch_size):
+        with transaction.atomic():
+            rows = FriendSuggestion.objects.filter(user__in=batch)
+            # The other way first, by the pairs rather than a scan of the
+            # candidates. A write first also takes the lock of SQLite
+            # before anything is read.
+            FriendSuggestion.objects.filter(
+                user__in=rows.values("candidate"), candidate__in=batch,
+            ).delete()
+            rows.delete()
+            count_mutual(batch, mirror=True)
+
+
+@on("friends.added", "friends.removed")
+def refresh_friends(payloads):
+    """
+    Count again the pairs of the users whose friends changed.
+    """
+    refresh_suggestions(x for payload in payloads for x in payload["users"])
+
+
+def rebuild_suggestions(batch_size=BATCH_SIZE):
+    """
+    Compute every count from the friends, batch_size users at a time.
+
+    Every batch of users is rebuilt in its own transaction, so the
+    memory used is bounded by the size of a batch and the table stays
+    readable during the rebuild. Yield the number of users done.
+    """
+    user_ids = Friend.objects.order_by("user").values_list("user", flat=True).distinct()
+    done = 0
+    last = 0
+    while True:
+        batch = list(user_ids.filter(user__gt=last)[:batch_size])
+        if not batch:
+            break
+
+        with transaction.atomic():
+            # Also the rows of the users without friends any more
+            FriendSuggestion.objects.filter(user__gt=last, user__lte=batch[-1]).delete()
+            count_mutual(batch)
+
+        done += len(batch)
+        last = batch[-1]
+        yield done
+
+    FriendSuggestion.objects.filter(user__gt=last).delete()
@@ -0,0 +1,168 @@
+"""
+Background tasks of the writes, in a queue kept in the database.
+
+The helpers of ``myapi.utils`` and the serializers ``emit`` events, e.g.
+"friends.added" with the ids of the users. ``on`` subscribes a handler to
+events: every event becomes one ``Task`` per handler, inserted in the
+transaction of the write, so the workers see it once the write is
+committed and never for a write rolled back. An event without handlers
+costs nothing.
+
+``manage.py run_tasks`` runs the tasks; on PostgreSQL, workers side by
+side skip the tasks locked by the others. A handler gets the payloads of up
+to ``batch_size`` tasks of its name at once, in one transaction. When a
+batch fails, its tasks are run again one by one, so that only the failing
+ones are retried: after ``RETRY_DELAY`` seconds, doubled at every attempt,
+up to ``MAX_ATTEMPTS``, then kept as failed. The handlers must thus
+give the same result when run twice.
+
+With ``EAGER`` in ``settings.MYAPI_TASKS``, in development and in the
+tests, the handlers run in the process once the transaction commits,
+without the queue.
+"""
+import logging
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from users_site.models import Task
+
+logger = logging.getLogger("myapi.tasks")
+
+
+@dataclass
+class Handler:
+    name: str
+    function: object
+    batch_size: int
+
+
+# Handlers by name, and the handlers of every event
+handlers = {}
+subscribers = {}
+
+
+def get_config():
+    return {
+        "EAGER": False,
+        "MAX_ATTEMPTS": 5,
+        "RETRY_DELAY": 10,
+        **getattr(settings, "MYAPI_TASKS", {}),
+    }
+
+
+def on(*events, batch_size=100):
+    """
+    Run the decorated function with the payloads of the events, a list
+    of up to batch_size of them.
+    """
+    def register(function):
+        handler = Handler(f"{function.__module__}.{function.__name__}", function, batch_size)
+        handlers[handler.name] = handler
+        for event in events:
+            subscribers.setdefault(event, []).append(handler)
+        return function
+    return register
+
+
+def emit(event, payload):
+    """
+    Queue the handlers of the event, with a payload which JSON can encode.
+    """
+    subscribed = subscribers.get(event)
+    if not subscribed:
+        return
+    if get_config()["EAGER"]:
+        for handler in subscribed:
+            # The write is done: a failing handler is logged, not raised
+            transaction.on_commit(lambda x=handler: run_batch(x, [payload]), robust=True)
+        return
+    Task.objects.bulk_create(
+        [Task(name=handler.name, payload=payload) for handler in subscribed]
+    )
+
+
+def run_batch(handler, payloads):
+    with transaction.atomic():
+        handler.function(payloads)
+
+
+def fail(task, error):
+    config = get_config()
+    task.attempts += 1
+    task.error = error
+    task.failed = task.attempts >= config["MAX_ATTEMPTS"]
+    task.run_at = timezone.now() + timedelta(
+        seconds=config["RETRY_DELAY"] * 2 ** (task.attempts - 1)
+    )
+    task.save(update_fields=["attempts", "error", "failed", "run_at"])
+    logger.warning("Task %s failed, attempt %s:\n%s", task, task.attempts, error)
+
+
+def run_tasks():
+    """
+    Run one batch of the due tasks of the oldest name not taken by the
+    other workers, locked against them until it is done. Return the number
+    of tasks run.
+    """
+    due = Task.objects.filter(failed=False, run_at__lte=timezone.now())
+    with transaction.atomic():
+        first = due.select_for_update(skip_locked=True).order_by("run_at", "id").first()
+        if first is None:
+            return 0
+        handler = handlers.get(first.name)
+        if handler is None:
+            first.failed = True
+            first.error = "No handler"
+            first.save(update_fields=["failed", "error"])
+            return 1
+
+        tasks = list(
+            due.select_for_update(skip_locked=True).filter(
+                name=first.name,
+            ).order_by("run_at", "id")[:handler.batch_size]
+        )
+        try:
+            run_batch(handler, [x.payload for x in tasks])
+        except Exception:
+            if len(tasks) == 1:
+                fail(tasks[0], traceback.format_exc(limit=5))
+                return 1
+        else:
+            Task.objects.filter(id__in=[x.id for x in tasks]).delete()
+            return len(tasks)
+
+        for task in tasks:
+            try:
+                run_batch(handler, [task.payload])
+            except Exception:
+                fail(task, traceback.format_exc(limit=5))
+            else:
+                task.delete()
+    return len(tasks)
+
+
+def work(once=False, sleep=1.0):
+    """
+    Run the tasks as they come, or until none is due with once. Return
+    the number of tasks run.
+    """
+    done = 0
+    while True:
+        # As Django does around a request: the worker outlives
+        # CONN_MAX_AGE and the restarts of the database
+        close_old_connections()
+        try:
+            count = run_tasks()
+        finally:
+            close_old_connections()
+        done += count
+        if not count:
+            if once:
+                return done
+            time.sleep(sleep)
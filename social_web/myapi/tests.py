@@ -1,13 +1,75 @@
+import csv
+import json
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.http import HttpResponse
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.color import no_style
 from django.urls import reverse
-from rest_framework.test import APIClient, APITestCase
+from django.test import (
+    RequestFactory, SimpleTestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from myapi.bench import seed_graph, get_cases, route_names, run_benchmark
+from myapi.cache import get_cache, stats
+from myapi.graph import GENERATION_KEY, change_key
+from myapi.metrics import HISTOGRAMS
+from myapi.profiling import list_profiles, state as profiling_state
+from myapi.pubsub import RedisPubSub, get_pubsub
+from myapi.querycheck import QueryCheckMixin
+from myapi.routers import PIN_COOKIE, ReplicaMiddleware, pin_key
+from myapi.suggestions import rebuild_suggestions, refresh_suggestions
+from myapi.tasks import emit, handlers, on, run_tasks, subscribers, work
+from myapi.throttling import get_stats as get_throttle_stats, rejected
+from myapi.utils import (
+    set_relationship, send_request, accept_friend, create_jwt, get_relationship,
+    remove_friend,
+    remove_requests,
+)
+from social_web.asgi import application
+from social_web.settings import base as base_settings
+from users_site.models import (
+    Profile, Friend, FriendRequest, FriendSuggestion, Message, Relationship, Task,
+)
+
+
+def make_friends(me, friend):
+    """
+    Send a request from the friend, and accept it.
+    """
+    send_request(friend, me)
+    accept_friend(me, friend)
+
 
-from users_site.models import Profile, Friend, FriendRequest
+def reset_sequences(*models):
+    """
+    Start the ids of the models from 1 again, as the tests expect: the
+    sequences of PostgreSQL are not rolled back with the test data.
+    """
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
 
 
-class Base(APITestCase):
+class FixtureMixin:
+    """
+    Users 1 to 4: 1 is a friend of 2, has a request from 3 and one to 4.
+    """
     def setUp(self) -> None:
+        get_cache().clear()
+        reset_sequences(User, Profile, FriendRequest, Message)
+
         # User1
         self.user = get_user_model().objects.create_user(
             username="TestUser1",
@@ -72,6 +134,16 @@ class Base(APITestCase):
             from_user=self.profile,
         )
 
+        # Relationships
+        set_relationship(self.profile, self.profile2, Relationship.FRIENDS)
+        set_relationship(self.profile, self.profile3, Relationship.INCOMING)
+        set_relationship(self.profile, self.profile4, Relationship.OUTGOING)
+
+
+@override_settings(MYAPI_TASKS={"EAGER": True})
+class Base(FixtureMixin, APITestCase):
+    pass
+
 
 class UserRegistrationAPIView(APITestCase):
     def setUp(self) -> None:
@@ -102,12 +174,56 @@ class UserFriendAPITestCase(Base):
         self.url = reverse("friends-list")
         response = self.client.get(self.url)
         self.assertEquals(response.status_code, 200)
+        answer = {
+            "user": {"id": 1, "username": "TestUser1"},
+            "next": None,
+            "previous": None,
+            "friends": [{"id": 2, "username": "TestUser2"}],
+        }
+        self.assertEquals(response.data, answer)
+
+    def test_get_pages(self):
+        for profile in [self.profile3, self.profile4]:
+            Friend.objects.create(user=self.profile, friend=profile)
+        url = reverse("friends-list")
+        response = self.client.get(url, data={"page_size": 2, "fields": "id"})
+        self.assertEquals(response.data["friends"], [{"id": 2}, {"id": 3}])
+
+        response = self.client.get(response.data["next"])
+        self.assertEquals(response.data["friends"], [{"id": 4}])
+        self.assertIsNone(response.data["next"])
+
+    def test_get_wrong_fields(self):
+        url = reverse("friends-list")
+        response = self.client.get(url, data={"fields": "id,phone"})
+        self.assertEquals(response.status_code, 400)
+
+    def test_get_unpaginated(self):
+        url = reverse("friends-list")
+        response = self.client.get(url, data={"paginate": "false"})
         answer = {
             "user": {"id": 1, "username": "TestUser1"},
             "friends": [{"id": 2, "username": "TestUser2"}],
         }
         self.assertEquals(response.data, answer)
 
+    def test_get_cached(self):
+        url = reverse("friends-list") + "?paginate=false"
+        self.client.get(url)
+        hits = stats["hits"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEquals(stats["hits"], hits + 1)
+        self.assertEquals(
+            response.data["friends"], [{"id": 2, "username": "TestUser2"}]
+        )
+
+        # Deleting the friend drops the cached list
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("friends-detail", kwargs={"pk": 2}))
+        response = self.client.get(url)
+        self.assertEquals(response.data["friends"], [])
+
     def test_get_you(self):
         url = reverse("friends-detail", kwargs={"pk": 1})
         response = self.client.get(url)
@@ -138,6 +254,24 @@ class UserFriendAPITestCase(Base):
         answer = {'status': "Outgoing request.", 'username': 'TestUser4'}
         self.assertEquals(response.data, answer)
 
+    def test_get_nothing(self):
+        url = reverse("friends-detail", kwargs={"pk": 2})
+        self.client.delete(url)
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 400)
+        answer = {'status': "Nothing", 'username': 'TestUser2'}
+        self.assertEquals(response.data, answer)
+
+    def test_get_status(self):
+        url = reverse("friends-statuses")
+        with self.assertNumQueries(2):
+            response = self.client.get(url, data={"ids": "2,3,4,5"})
+        self.assertEquals(response.status_code, 200)
+        answer = {
+            "statuses": {2: "friends", 3: "incoming", 4: "outgoing", 5: "none"}
+        }
+        self.assertEquals(response.data, answer)
+
     def test_delete(self):
         url = reverse("friends-detail", kwargs={"pk": 2})
         response = self.client.delete(url)
@@ -156,6 +290,105 @@ class UserFriendAPITestCase(Base):
         self.assertEquals(response.data, answer)
 
 
+    def test_create_message(self):
+        url = reverse("friends-create-message", kwargs={"pk": 2})
+        response = self.client.post(url, data={"messages": "Hello"})
+        message = Message.objects.get(conversation="1:2")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data, {"message": f"{message}"})
+        self.assertEquals(message.sender, self.profile)
+        self.assertEquals(message.text, "Hello")
+
+    def test_create_message_not_friend(self):
+        url = reverse("friends-create-message", kwargs={"pk": 3})
+        response = self.client.post(url, data={"messages": "Hello"})
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_list_message(self):
+        for number in range(3):
+            Message.objects.create(
+                conversation="1:2",
+                sender=self.profile2,
+                text=f"Message {number}",
+            )
+        url = reverse("friends-list-message", kwargs={"pk": 2})
+        response = self.client.get(url, data={"page_size": 2})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            [x["text"] for x in response.data["results"]],
+            ["Message 2", "Message 1"],
+        )
+        self.assertEquals(response.data["results"][0]["username"], "TestUser2")
+
+        response = self.client.get(response.data["next"])
+        self.assertEquals(
+            [x["text"] for x in response.data["results"]],
+            ["Message 0"],
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_new_messages(self):
+        messages = [
+            Message.objects.create(
+                conversation="1:2",
+                sender=self.profile2,
+                text=f"Message {number}",
+            )
+            for number in range(4)
+        ]
+        url = reverse("friends-list-message", kwargs={"pk": 2})
+        response = self.client.get(url, data={"after_id": messages[0].id, "page_size": 2})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            [x["text"] for x in response.data["results"]],
+            ["Message 1", "Message 2"],
+        )
+
+        response = self.client.get(response.data["next"])
+        self.assertEquals(
+            [x["text"] for x in response.data["results"]],
+            ["Message 3"],
+        )
+        self.assertIsNone(response.data["next"])
+
+        since = messages[2].created_at.isoformat().replace("+00:00", "Z")
+        response = self.client.get(url, data={"since": since})
+        self.assertEquals(
+            [x["text"] for x in response.data["results"]],
+            ["Message 3"],
+        )
+
+        for params in ({"after_id": 999}, {"since": "yesterday"}):
+            response = self.client.get(url, data=params)
+            self.assertEquals(response.status_code, 400)
+
+    def test_export_message(self):
+        for number in range(3):
+            Message.objects.create(
+                conversation="1:2",
+                sender=self.profile2,
+                text=f"Message {number}",
+            )
+        url = reverse("friends-export-message", kwargs={"pk": 2})
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response["Content-Type"], "application/x-ndjson")
+        lines = [
+            json.loads(x) for x in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEquals([x["text"] for x in lines], ["Message 0", "Message 1", "Message 2"])
+        self.assertEquals(lines[0]["username"], "TestUser2")
+
+        response = self.client.get(url, data={"type": "csv"})
+        rows = list(csv.reader(
+            b"".join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEquals(rows[0], ["id", "sender", "username", "text", "created_at"])
+        self.assertEquals(rows[1][3], "Message 0")
+        self.assertEquals(len(rows), 4)
+
+
 class RequestAPI(Base):
     def setUp(self) -> None:
         self.client = APIClient()
@@ -180,6 +413,19 @@ class RequestAPI(Base):
         }
         self.assertEquals(response.data, answer)
 
+    def test_get_cached(self):
+        url = reverse("requests-list")
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, data={"to_user": self.profile5.id})
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEquals(
+            response.data["outgoing_requests"],
+            [{"id": 4, "username": "TestUser4"}, {"id": 5, "username": "TestUser5"}],
+        )
+
     def test_post(self):
         url = reverse("requests-list")
         response = self.client.post(url, data={"to_user": self.profile5.id})
@@ -190,8 +436,37 @@ class RequestAPI(Base):
         answer = {'message': 'A friend request has been sent to user TestUser5'}
         self.assertEquals(response.data, answer)
         self.assertTrue(request)
+        relationship = Relationship.objects.get(
+            user=self.profile5,
+            other=self.profile,
+        )
+        self.assertEquals(relationship.state, Relationship.INCOMING)
         self.assertEquals(response.status_code, 201)
 
+    def test_post_twice(self):
+        url = reverse("requests-list")
+        self.client.post(url, data={"to_user": self.profile5.id})
+        response = self.client.post(url, data={"to_user": self.profile5.id})
+        answer = {
+            'message': 'A friend request has already been sent to user TestUser5'
+        }
+        self.assertEquals(response.data, answer)
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(
+            FriendRequest.objects.filter(
+                to_user=self.profile5,
+                from_user=self.profile,
+            ).count(),
+            1,
+        )
+
+    def test_post_to_friend(self):
+        url = reverse("requests-list")
+        response = self.client.post(url, data={"to_user": self.profile2.id})
+        answer = {'message': 'User TestUser2 is already you\'re friend'}
+        self.assertEquals(response.data, answer)
+        self.assertEquals(response.status_code, 400)
+
     def test_post_with_incoming_request(self):
         url = reverse("requests-list")
         response = self.client.post(url, data={"to_user": self.profile3.id})
@@ -217,6 +492,17 @@ class RequestAPI(Base):
         self.assertEqual(response.data, answer)
         self.assertTrue(friend)
 
+    def test_post_accept_withdrawn(self):
+        # Withdrawn between the check of the view and the lock
+        stale = get_relationship(self.profile, 3)
+        remove_requests(self.profile3, self.profile)
+        url = reverse("requests-create-friend", kwargs={"pk": 3})
+        with mock.patch("myapi.views.get_relationship", return_value=stale):
+            response = self.client.post(url, data={"choice": "accept"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Friend.objects.filter(user=self.profile, friend=self.profile3))
+        self.assertFalse(FriendRequest.objects.filter(from_user=self.profile3))
+
     def test_post_decline_id(self):
         url = reverse("requests-create-friend", kwargs={"pk": 3})
         request_from_user = FriendRequest.objects.filter(
@@ -232,3 +518,991 @@ class RequestAPI(Base):
         self.assertFalse(request_from_user)
         self.assertEqual(response.data, answer)
         self.assertEqual(response.status_code, 200)
+
+    def test_post_bulk(self):
+        url = reverse("requests-bulk")
+        data = {
+            "usernames": ["TestUser5", "Nobody"],
+            "ids": [1, 2, 3, 4],
+        }
+        response = self.client.post(url, data=data, format="json")
+        answer = [
+            {"username": "TestUser5", "id": 5, "status": "sent"},
+            {"username": "Nobody", "status": "not_found"},
+            {"id": 1, "status": "yourself"},
+            {"id": 2, "status": "already_friends"},
+            {"id": 3, "status": "accepted"},
+            {"id": 4, "status": "already_sent"},
+        ]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], answer)
+        self.assertTrue(
+            FriendRequest.objects.filter(to_user=self.profile5, from_user=self.profile)
+        )
+        self.assertTrue(Friend.objects.filter(user=self.profile, friend=self.profile3))
+
+        response = self.client.post(url, data={}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_bulk_answer(self):
+        send_request(self.profile5, self.profile)
+        url = reverse("requests-bulk-answer")
+        data = {"ids": [3, 5, 4], "choice": "accept"}
+        response = self.client.post(url, data=data, format="json")
+        answer = [
+            {"id": 3, "status": "accepted"},
+            {"id": 5, "status": "accepted"},
+            {"id": 4, "status": "no_request"},
+        ]
+        self.assertEqual(response.data["results"], answer)
+        self.assertEqual(
+            set(self.profile.user_friends.values_list("friend_id", flat=True)),
+            {2, 3, 5},
+        )
+
+
+@override_settings(MYAPI_TASKS={"EAGER": False})
+class QueryBudgetAPI(QueryCheckMixin, Base):
+    """
+    Number of queries of every endpoint, with a cold cache, and no N+1
+    or slow query. With the tasks queued, as in production.
+    """
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        super().setUp()
+
+    def assertBudget(self, budget, method, url, data=None, max_repeats=None):
+        with self.assertNumQueries(budget), self.assertQueryCheck(max_repeats):
+            response = getattr(self.client, method)(url, data=data)
+        self.assertLess(response.status_code, 300)
+
+    def test_profile(self):
+        self.assertBudget(1, "get", reverse("profile-list"))
+        self.assertBudget(
+            3, "put", reverse("profile-update-user"), {"phone": "+999 99 999 99 99"}
+        )
+        self.assertBudget(3, "get", reverse("profile-search"), {"q": "TestUser"})
+
+    def test_friends(self):
+        self.assertBudget(2, "get", reverse("friends-list"))
+        self.assertBudget(2, "get", reverse("friends-detail", kwargs={"pk": 2}))
+        self.assertBudget(2, "get", reverse("friends-statuses"), {"ids": "2,3"})
+        self.assertBudget(2, "get", reverse("friends-suggestions"))
+        # With the load of the friends index
+        self.assertBudget(3, "get", reverse("friends-mutual", kwargs={"pk": 3}))
+        get_cache().clear()
+        self.assertBudget(3, "get", reverse("friends-path", kwargs={"pk": 3}))
+        self.assertBudget(
+            3, "get", reverse("friends-list-message", kwargs={"pk": 2})
+        )
+        self.assertBudget(
+            3,
+            "post",
+            reverse("friends-create-message", kwargs={"pk": 2}),
+            {"messages": "Hello"},
+        )
+        # With the savepoint, the lock and the check of the friends under it
+        self.assertBudget(14, "delete", reverse("friends-detail", kwargs={"pk": 2}))
+
+    def test_requests(self):
+        self.assertBudget(3, "get", reverse("requests-list"))
+        self.assertBudget(2, "get", reverse("requests-detail", kwargs={"pk": 3}))
+        self.assertBudget(
+            11, "post", reverse("requests-list"), {"to_user": self.profile3.id}
+        )
+
+    def test_bulk(self):
+        # The same for every number of users
+        for number in range(5, 10):
+            Profile.objects.create(username=f"TestUser{number}")
+        self.assertBudget(8, "post", reverse("requests-bulk"), {"ids": [5]})
+        self.assertBudget(
+            8, "post", reverse("requests-bulk"), {"ids": [2, 4, 6, 7]}
+        )
+        # Accepts and sends
+        self.assertBudget(
+            13, "post", reverse("requests-bulk"), {"ids": [3, 8, 9]}
+        )
+
+    def test_create_friend(self):
+        # With the check of the request under the lock
+        self.assertBudget(
+            11,
+            "post",
+            reverse("requests-create-friend", kwargs={"pk": 3}),
+            {"choice": "accept"},
+        )
+
+    def test_lists_with_more_rows(self):
+        # The related profiles come with the select_related of the lists
+        for number in range(5, 15):
+            profile = Profile.objects.create(username=f"TestUser{number}")
+            Friend.objects.create(user=self.profile, friend=profile)
+            FriendRequest.objects.create(to_user=self.profile, from_user=profile)
+        self.assertBudget(2, "get", reverse("friends-list"))
+        self.assertBudget(2, "get", reverse("friends-list"), {"paginate": "false"})
+        self.assertBudget(3, "get", reverse("requests-list"))
+
+    def test_query_check(self):
+        with self.assertRaisesMessage(AssertionError, "N+1: run 3 times"):
+            with self.assertQueryCheck():
+                for pk in (2, 3, 4):
+                    Profile.objects.get(pk=pk)
+        with self.assertRaisesMessage(AssertionError, "slow:"):
+            with self.assertQueryCheck(slow_query=0):
+                Profile.objects.get(pk=2)
+        with self.assertQueryCheck():
+            list(Profile.objects.filter(pk__in=[2, 3]))
+            list(Profile.objects.filter(pk__in=[2, 3, 4]))
+
+
+class JWTAuthenticationAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        self.client = APIClient()
+        self.client.cookies["jwt"] = create_jwt(self.user)
+
+    def test_token_auth(self):
+        url = reverse("token_auth-list")
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        answer = {"message": "User TestUser1 authorize"}
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, answer)
+
+    def test_get_profile(self):
+        url = reverse("profile-list")
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["username"], "TestUser1")
+
+    def test_bearer(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {create_jwt(self.user2)}")
+        response = client.get(reverse("profile-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["username"], "TestUser2")
+
+    def test_invalid_cookie(self):
+        self.client.cookies["jwt"] = "invalid"
+        response = self.client.get(reverse("profile-list"))
+        self.assertEqual(response.status_code, 401)
+
+    def test_cookie_csrf(self):
+        client = APIClient(enforce_csrf_checks=True)
+        client.cookies["jwt"] = create_jwt(self.user)
+        response = client.get(reverse("profile-list"))
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(reverse("requests-list"), data={"to_user": 2})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("CSRF Failed", response.data["detail"])
+
+
+class AsyncAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        self.async_client.cookies["jwt"] = create_jwt(self.user)
+
+    async def test_friends_list(self):
+        response = await self.async_client.get(reverse("async-friends-list"))
+        answer = {
+            "user": {"id": 1, "username": "TestUser1"},
+            "friends": [{"id": 2, "username": "TestUser2"}],
+        }
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), answer)
+
+    async def test_friends_detail(self):
+        answers = {
+            1: "It is you're id man.",
+            2: "Already friends.",
+            3: "Incoming request.",
+            4: "Outgoing request.",
+        }
+        for pk, answer in answers.items():
+            url = reverse("async-friends-detail", kwargs={"pk": pk})
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["status"], answer)
+
+    async def test_requests_list(self):
+        response = await self.async_client.get(reverse("async-requests-list"))
+        answer = {
+            "username": "TestUser1",
+            "incoming_requests": [{"id": 3, "username": "TestUser3"}],
+            "outgoing_requests": [{"id": 4, "username": "TestUser4"}],
+        }
+        self.assertEqual(response.json(), answer)
+
+    async def test_requests_detail(self):
+        url = reverse("async-requests-detail", kwargs={"pk": 3})
+        response = await self.async_client.get(url)
+        answer = {"message": "User TestUser3 wants to add you as a friend"}
+        self.assertEqual(response.json(), answer)
+
+        # The same answers as the sync view
+        for pk in (2, 4):
+            url = reverse("async-requests-detail", kwargs={"pk": pk})
+            response = await self.async_client.get(url)
+            sync = await sync_to_async(self.client.get)(
+                reverse("requests-detail", kwargs={"pk": pk})
+            )
+            self.assertEqual(response.json(), sync.data)
+
+    async def test_renamed(self):
+        # The token still has the old username
+        await Profile.objects.filter(id=1).aupdate(username="Renamed")
+        response = await self.async_client.get(reverse("async-requests-list"))
+        self.assertEqual(response.json()["username"], "Renamed")
+
+    async def test_unauthenticated(self):
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse("async-friends-list"))
+        self.assertEqual(response.status_code, 401)
+
+
+class SuggestionAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        self.profile5 = Profile.objects.create(username="TestUser5")
+        self.profile6 = Profile.objects.create(username="TestUser6")
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_friend(self.profile, self.profile3)
+            make_friends(self.profile2, self.profile5)
+            make_friends(self.profile2, self.profile6)
+            make_friends(self.profile3, self.profile6)
+            make_friends(self.profile2, self.profile4)
+
+    def get_suggestions(self):
+        response = self.client.get(reverse("friends-suggestions"))
+        self.assertEqual(response.status_code, 200)
+        return [(x["id"], x["mutual"]) for x in response.data["suggestions"]]
+
+    def get_counts(self):
+        return set(FriendSuggestion.objects.values_list("user", "candidate", "mutual"))
+
+    def test_suggestions(self):
+        # Not the user 4, who has a pending request
+        self.assertEqual(self.get_suggestions(), [(6, 2), (5, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("friends-detail", kwargs={"pk": 3}))
+        self.assertEqual(self.get_suggestions(), [(5, 1), (6, 1)])
+
+    def test_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("friends-detail", kwargs={"pk": 3}))
+        counts = self.get_counts()
+        self.assertIn((5, 6, 1), counts)
+
+        FriendSuggestion.objects.filter(user=self.profile4).update(mutual=9)
+        FriendSuggestion.objects.create(user=self.profile, candidate=self.profile3, mutual=1)
+        list(rebuild_suggestions(batch_size=2))
+        self.assertEqual(self.get_counts(), counts)
+
+    def test_refresh(self):
+        counts = self.get_counts()
+        FriendSuggestion.objects.filter(user=self.profile4).update(mutual=9)
+        FriendSuggestion.objects.filter(candidate=self.profile5).delete()
+        refresh_suggestions(Profile.objects.values_list("id", flat=True), batch_size=2)
+        self.assertEqual(self.get_counts(), counts)
+
+
+class GraphAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        self.profile5 = Profile.objects.create(username="TestUser5")
+        with self.captureOnCommitCallbacks(execute=True):
+            make_friends(self.profile2, self.profile3)
+            make_friends(self.profile3, self.profile5)
+
+    def get_path(self, pk, **params):
+        url = reverse("friends-path", kwargs={"pk": pk})
+        return self.client.get(url, params).data
+
+    def test_mutual(self):
+        response = self.client.get(reverse("friends-mutual", kwargs={"pk": 3}))
+        self.assertEqual(
+            response.data, {"count": 1, "friends": [{"id": 2, "username": "TestUser2"}]}
+        )
+
+        response = self.client.get(reverse("friends-mutual", kwargs={"pk": 99}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_path(self):
+        self.assertEqual(
+            [x["id"] for x in self.get_path(5)["path"]], [1, 2, 3, 5]
+        )
+        self.assertEqual(self.get_path(5, max_hops=2), {"degree": None, "path": []})
+
+        # The friends changed by this process
+        with self.captureOnCommitCallbacks(execute=True):
+            make_friends(self.profile, self.profile5)
+        self.assertEqual(self.get_path(5)["degree"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("friends-detail", kwargs={"pk": 5}))
+        self.assertEqual(self.get_path(5)["degree"], 3)
+
+    def test_sync(self):
+        self.assertEqual(self.get_path(5)["degree"], 3)
+
+        # Changed by another process: only logged in the cache
+        Friend.objects.bulk_create(
+            [Friend(user=self.profile, friend=self.profile5),
+             Friend(user=self.profile5, friend=self.profile)]
+        )
+        cache = get_cache()
+        generation = cache.incr(GENERATION_KEY)
+        cache.set(change_key(generation), [1, 5])
+        self.assertEqual(self.get_path(5)["degree"], 1)
+
+        # Without the log, the index is loaded again
+        Friend.objects.filter(user__in=[1, 5], friend__in=[1, 5]).delete()
+        cache.clear()
+        self.assertEqual(self.get_path(5)["degree"], 3)
+
+
+class SearchAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        Profile.objects.create(username="john_smith")
+        Profile.objects.create(username="Johnny")
+        Profile.objects.create(username="smithson")
+
+    def search(self, q, **params):
+        response = self.client.get(reverse("profile-search"), {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(x["username"], x["match"]) for x in response.data["results"]]
+
+    def test_search(self):
+        self.assertEqual(
+            self.search("JOHN"),
+            [("john_smith", "exact"), ("Johnny", "prefix")],
+        )
+        self.assertEqual(
+            self.search("smith"),
+            [("john_smith", "exact"), ("smithson", "prefix")],
+        )
+        # A typo
+        self.assertEqual(self.search("johnyy"), [("Johnny", "fuzzy")])
+        self.assertEqual(self.search("nobody"), [])
+        # The wildcards of LIKE are letters of the query
+        self.assertEqual(self.search("john_"), [("john_smith", "prefix")])
+        self.assertEqual(self.search("j%"), [])
+
+    def test_pages(self):
+        response = self.client.get(reverse("profile-search"), {"q": "test", "page_size": 3})
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(
+            [x["username"] for x in response.data["results"]],
+            ["TestUser1", "TestUser2", "TestUser3"],
+        )
+        response = self.client.get(response.data["next"])
+        self.assertEqual([x["username"] for x in response.data["results"]], ["TestUser4"])
+
+    def test_rename(self):
+        self.client.put(reverse("profile-update-user"), {"username": "Renamed"})
+        self.assertEqual(self.search("renamed"), [("Renamed", "exact")])
+        self.assertNotIn(("TestUser1", "prefix"), self.search("testuser"))
+
+    def test_no_query(self):
+        response = self.client.get(reverse("profile-search"), {"q": " "})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalAPI(Base):
+    def test_friends_list(self):
+        url = reverse("friends-list")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertNotIn("Last-Modified", response)
+        # The ETag only
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT")
+        self.assertEquals(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response["ETag"], etag)
+
+        # Another query is another body
+        response = self.client.get(url, {"fields": "id"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_friend(self.profile, self.profile3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.data["friends"]), 2)
+
+    def test_requests_list(self):
+        url = reverse("requests-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEquals(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+
+        # Accepts the request of the user 3
+        with self.captureOnCommitCallbacks(execute=True):
+            send_request(self.profile, self.profile3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data["incoming_requests"], [])
+
+    def test_profile(self):
+        url = reverse("profile-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEquals(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse("profile-update-user"), {"phone": "+999 99 999 99 99"})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response["ETag"], etag)
+
+
+@override_settings(MYAPI_THROTTLE_RATES={"message_pair": "2/min", "request_user": "1/min"})
+class ThrottleAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        rejected.clear()
+
+    def test_create_message(self):
+        url = reverse("friends-create-message", kwargs={"pk": 2})
+        for _ in range(2):
+            response = self.client.post(url, {"messages": "Hello"})
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(url, {"messages": "Hello"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(get_throttle_stats(), {"rejected": {"message_pair": 1}})
+
+    def test_create_request(self):
+        profile5 = Profile.objects.create(username="TestUser5")
+        url = reverse("requests-list")
+        response = self.client.post(url, {"to_user": profile5.id})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(url, {"to_user": 3})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "60")
+
+    def test_bulk(self):
+        url = reverse("requests-bulk")
+        response = self.client.post(url, {"ids": [5, 6, 7]}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        # One token per user: 3 minutes to pay back
+        response = self.client.post(reverse("requests-list"), {"to_user": 3})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "180")
+        response = self.client.post(url, {"ids": [3]}, format="json")
+        self.assertEqual(response.status_code, 429)
+
+    def test_stats(self):
+        response = self.client.get(reverse("throttle_stats-list"))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.post(reverse("requests-list"), {"to_user": 3})
+        self.client.post(reverse("requests-list"), {"to_user": 3})
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("throttle_stats-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"rejected": {"request_user": 1}})
+
+
+@override_settings(MYAPI_METRICS_TOKEN=None)
+class MetricsAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        for histogram in HISTOGRAMS:
+            histogram.series.clear()
+
+    def get_metrics(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        return dict(
+            line.rsplit(" ", 1) for line in response.content.decode().splitlines()
+            if not line.startswith("#")
+        )
+
+    def test_metrics(self):
+        self.client.get(reverse("friends-list"))
+        self.client.post(
+            reverse("friends-create-message", kwargs={"pk": 2}), {"messages": "Hello"}
+        )
+        self.client.get(reverse("friends-list"))
+
+        metrics = self.get_metrics()
+        view = 'view="FriendViewSet.list"'
+        self.assertEqual(metrics[f"myapi_request_duration_seconds_count{{{view}}}"], "2")
+        self.assertEqual(metrics[f'myapi_db_queries_bucket{{{view},le="+Inf"}}'], "2")
+        self.assertGreater(int(metrics[f"myapi_db_queries_sum{{{view}}}"]), 0)
+        self.assertGreater(float(metrics[f"myapi_db_duration_seconds_sum{{{view}}}"]), 0)
+        self.assertIn(
+            'myapi_db_queries_count{view="FriendViewSet.create_message"}', metrics
+        )
+
+    def test_stream(self):
+        Message.objects.create(conversation="1:2", sender=self.profile2, text="Hello")
+        response = self.client.get(reverse("friends-export-message", kwargs={"pk": 2}))
+        view = 'view="FriendViewSet.export_message"'
+        self.assertNotIn(f"myapi_db_queries_count{{{view}}}", self.get_metrics())
+
+        b"".join(response.streaming_content)
+        metrics = self.get_metrics()
+        self.assertEqual(metrics[f"myapi_db_queries_count{{{view}}}"], "1")
+        # The profile, the relationship and the messages of the stream
+        self.assertEqual(metrics[f"myapi_db_queries_sum{{{view}}}"], "3")
+
+    async def test_async(self):
+        self.async_client.cookies["jwt"] = await sync_to_async(create_jwt)(self.user)
+        await self.async_client.get(reverse("async-friends-list"))
+        await self.async_client.get(reverse("friends-list"))
+
+        metrics = await sync_to_async(self.get_metrics)()
+        for view in ('view="friends_list"', 'view="FriendViewSet.list"'):
+            self.assertEqual(metrics[f"myapi_request_duration_seconds_count{{{view}}}"], "1")
+            self.assertGreater(int(metrics[f"myapi_db_queries_sum{{{view}}}"]), 0)
+
+    @override_settings(MYAPI_METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfilingAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        profiling_state["expires"] = 0
+        self.addCleanup(profiling_state.update, rate=0.0, expires=0)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(MYAPI_PROFILING={"DIR": self.directory, "KEEP": 2})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = reverse("profiling-list")
+
+    def test_toggle(self):
+        self.assertEqual(self.client.post(self.url, {"rate": 1}).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(self.url, {"rate": 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["message"], "Rate must be a number from 0 to 1")
+
+        response = self.client.post(self.url, {"rate": 1})
+        self.assertEqual(response.data, {"rate": 1.0})
+        self.client.post(
+            reverse("friends-create-message", kwargs={"pk": 2}), {"messages": "Hello"}
+        )
+        name = list_profiles()[0]
+        self.assertIn("FriendViewSet.create_message", name)
+        with open(f"{self.directory}/{name}.folded") as file:
+            stacks = file.read()
+        self.assertIn("FriendViewSet.create_message;", stacks)
+        self.assertIn("myapi.serializers:MessageSerializer.create", stacks)
+        with open(f"{self.directory}/{name}.json") as file:
+            summary = json.load(file)
+        self.assertEqual(summary["view"], "FriendViewSet.create_message")
+        self.assertEqual(summary["status"], 200)
+        self.assertGreater(summary["queries"]["count"], 0)
+
+        # Profiled too, the last one
+        self.client.post(self.url, {"rate": 0})
+        self.client.get(reverse("friends-list"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["rate"], 0)
+        self.assertEqual(len(response.data["profiles"]), 2)
+        self.assertEqual(response.data["profiles"][1], name)
+
+    def test_keep(self):
+        profiling_state["rate"] = 1
+        profiling_state["expires"] = float("inf")
+        for _ in range(3):
+            self.client.get(reverse("friends-list"))
+        self.client.get(reverse("metrics"))
+        self.assertEqual(len(list_profiles()), 2)
+        self.assertEqual(len(list(Path(self.directory).glob("*.json"))), 2)
+
+    async def test_async_view(self):
+        profiling_state["rate"] = 1
+        profiling_state["expires"] = float("inf")
+        self.async_client.cookies["jwt"] = await sync_to_async(create_jwt)(self.user)
+        response = await self.async_client.get(reverse("async-friends-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list_profiles(), [])
+
+
+@override_settings(MYAPI_TASKS={"EAGER": False, "MAX_ATTEMPTS": 3, "RETRY_DELAY": 0})
+class TaskAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        for registry in (handlers, subscribers):
+            patcher = mock.patch.dict(registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # It would close the connection of the test transaction
+        patcher = mock.patch("myapi.tasks.close_old_connections")
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.batches = []
+
+    def test_batches(self):
+        @on("messages.created", batch_size=2)
+        def notify(payloads):
+            self.batches.append([x["recipient"] for x in payloads])
+
+        url = reverse("friends-create-message", kwargs={"pk": 2})
+        for _ in range(3):
+            self.client.post(url, {"messages": "Hello"})
+        self.assertEqual(Task.objects.count(), 3)
+        self.assertEqual(self.batches, [])
+
+        self.assertEqual(work(once=True), 3)
+        self.assertEqual(self.batches, [[2, 2], [2]])
+        self.assertFalse(Task.objects.exists())
+        # Before and after every run, the last one of none
+        self.assertEqual(self.close_old_connections.call_count, 2 * 3)
+
+    def test_retries(self):
+        @on("test.event")
+        def handle(payloads):
+            if any(x["fail"] for x in payloads):
+                raise ValueError("Failed")
+            self.batches.append(payloads)
+
+        emit("test.event", {"fail": False})
+        emit("test.event", {"fail": True})
+        # Every attempt of the failing one, then none is due
+        with self.assertLogs("myapi.tasks", "WARNING") as logs:
+            self.assertEqual(work(once=True), 2 + 2)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(self.batches, [[{"fail": False}]])
+        task = Task.objects.get()
+        self.assertEqual(task.attempts, 3)
+        self.assertTrue(task.failed)
+        self.assertIn("ValueError: Failed", task.error)
+
+        Task.objects.create(name="myapi.gone", payload={})
+        self.assertEqual(run_tasks(), 1)
+        self.assertEqual(Task.objects.filter(failed=True).count(), 2)
+
+    def test_suggestions(self):
+        profile5 = Profile.objects.create(username="TestUser5")
+        make_friends(self.profile2, self.profile3)
+        make_friends(self.profile3, profile5)
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertFalse(FriendSuggestion.objects.exists())
+
+        # Also once more, as after a retry
+        Task.objects.create(name=Task.objects.first().name, payload={"users": [2, 3]})
+        work(once=True)
+        counts = set(FriendSuggestion.objects.values_list("user", "candidate", "mutual"))
+        self.assertIn((1, 3, 1), counts)
+        list(rebuild_suggestions())
+        self.assertEqual(
+            set(FriendSuggestion.objects.values_list("user", "candidate", "mutual")),
+            counts,
+        )
+
+    @override_settings(MYAPI_TASKS={"EAGER": True})
+    def test_eager_failure(self):
+        @on("test.event")
+        def handle(payloads):
+            raise ValueError("Failed")
+
+        # Logged, after the commit of the write
+        with self.assertLogs("django.test", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                emit("test.event", {})
+
+    def test_rollback(self):
+        @on("test.event")
+        def handle(payloads):
+            pass
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                emit("test.event", {})
+                raise ValueError
+        self.assertFalse(Task.objects.exists())
+
+
+@override_settings(MYAPI_REPLICAS=["replica"])
+class ReplicaAPI(Base):
+    def setUp(self) -> None:
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def get_alias(self, method, **kwargs):
+        """
+        Alias of the reads of a request, and the response.
+        """
+        aliases = []
+
+        def get_response(request):
+            aliases.append(Profile.objects.all().db)
+            return HttpResponse()
+
+        request = getattr(self.factory, method)("/api/friends/", **kwargs)
+        response = ReplicaMiddleware(get_response)(request)
+        return aliases[0], response
+
+    def test_reads(self):
+        self.assertEqual(self.get_alias("get")[0], "replica")
+        self.assertEqual(self.get_alias("post")[0], "default")
+        # Outside of the requests
+        self.assertEqual(Profile.objects.all().db, "default")
+
+    def test_read_your_writes(self):
+        token = f"Bearer {create_jwt(self.user)}"
+        self.get_alias("post", HTTP_AUTHORIZATION=token)
+        self.assertEqual(self.get_alias("get", HTTP_AUTHORIZATION=token)[0], "default")
+        # Another user
+        self.assertEqual(self.get_alias("get")[0], "replica")
+
+        get_cache().delete(pin_key(self.user.id))
+        self.assertEqual(self.get_alias("get", HTTP_AUTHORIZATION=token)[0], "replica")
+
+    def test_pin_cookie(self):
+        _, response = self.get_alias("post")
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], settings.MYAPI_REPLICA_PIN)
+
+        self.factory.cookies[PIN_COOKIE] = cookie.value
+        self.assertEqual(self.get_alias("get")[0], "default")
+
+    async def test_async(self):
+        aliases = []
+
+        async def get_response(request):
+            aliases.append(Profile.objects.all().db)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        token = f"Bearer {await sync_to_async(create_jwt)(self.user)}"
+        await middleware(self.factory.get("/api/friends/"))
+        await middleware(self.factory.post("/api/friends/", HTTP_AUTHORIZATION=token))
+        await middleware(self.factory.get("/api/friends/", HTTP_AUTHORIZATION=token))
+        self.assertEqual(aliases, ["replica", "default", "default"])
+
+
+class ASGIMiddlewareAPI(SimpleTestCase):
+    @override_settings(DEBUG=True)
+    def test_chain(self):
+        # Django logs every middleware it puts on a thread
+        with override_settings(MIDDLEWARE=base_settings.MIDDLEWARE):
+            with self.assertNoLogs("django.request", "DEBUG"):
+                ASGIHandler()
+
+        middleware = [*base_settings.MIDDLEWARE, "myapi.querycheck.QueryCheckMiddleware"]
+        with override_settings(MIDDLEWARE=middleware):
+            with self.assertLogs("django.request", "DEBUG") as logs:
+                ASGIHandler()
+        self.assertIn("QueryCheckMiddleware", logs.output[0])
+
+
+@skipUnless(settings.MYAPI_REPLICAS, "DATABASE_REPLICA_URLS is not set")
+class ReplicaDatabaseAPI(TransactionTestCase):
+    """
+    Runs with DATABASE_REPLICA_URLS, e.g. sqlite:///replica.sqlite3: the
+    test replicas mirror the test database of the primary.
+    """
+    databases = "__all__"
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.user = User.objects.create_user(username="TestUser1", password="Password123")
+        Profile.objects.create(user=self.user, username="TestUser1")
+        self.client.cookies["jwt"] = create_jwt(self.user)
+
+    def test_search(self):
+        replica = connections[settings.MYAPI_REPLICAS[0]]
+        with CaptureQueriesContext(replica) as context:
+            response = self.client.get(reverse("profile-search"), {"q": "test"})
+        self.assertEqual(response.data["count"], 1)
+        self.assertGreater(len(context.captured_queries), 0)
+
+
+@override_settings(MYAPI_TASKS={"EAGER": True})
+class WebSocketAPI(FixtureMixin, APITransactionTestCase):
+    """
+    The handshake queries on a thread of its own, out of the transaction
+    of a TestCase.
+    """
+    reset_sequences = True
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.token = create_jwt(self.user)
+        patcher = mock.patch(
+            "myapi.websockets.close_old_connections", wraps=close_old_connections
+        )
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, path, token=None, origin=None):
+        headers = [(b"cookie", f"jwt={token}".encode())] if token else []
+        if origin:
+            headers.append((b"origin", origin.encode()))
+        return ApplicationCommunicator(
+            application, {"type": "websocket", "path": path, "headers": headers}
+        )
+
+    def send_message(self, text):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse("friends-create-message", kwargs={"pk": 1})
+        self.client.post(url, {"messages": text})
+
+    async def test_new_message(self):
+        communicator = self.connect("/ws/friends/2/", self.token)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(await communicator.receive_output(), {"type": "websocket.accept"})
+        # Before and after the queries of the handshake
+        self.assertEqual(self.close_old_connections.call_count, 2)
+
+        await sync_to_async(self.send_message)("Hello")
+
+        event = await communicator.receive_output()
+        self.assertEqual(event["type"], "websocket.send")
+        message = json.loads(event["text"])
+        self.assertEqual(message["username"], "TestUser2")
+        self.assertEqual(message["text"], "Hello")
+
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait()
+
+    async def test_refused(self):
+        cases = [
+            ("/ws/friends/2/", None, 4401),
+            ("/ws/friends/3/", self.token, 4403),
+            ("/ws/nothing/", self.token, 4404),
+        ]
+        for path, token, code in cases:
+            communicator = self.connect(path, token)
+            await communicator.send_input({"type": "websocket.connect"})
+            event = await communicator.receive_output()
+            self.assertEqual(event, {"type": "websocket.close", "code": code})
+
+    async def test_origin(self):
+        communicator = self.connect("/ws/friends/2/", self.token, "http://evil.example")
+        await communicator.send_input({"type": "websocket.connect"})
+        event = await communicator.receive_output()
+        self.assertEqual(event, {"type": "websocket.close", "code": 4403})
+
+        communicator = self.connect("/ws/friends/2/", self.token, "http://testserver")
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(await communicator.receive_output(), {"type": "websocket.accept"})
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait()
+
+    @override_settings(MYAPI_PUBSUB={
+        "BACKEND": "myapi.pubsub.RedisPubSub", "LOCATION": "redis://redis:6379/0",
+    })
+    def test_redis_settings(self):
+        redis = mock.MagicMock()
+        get_pubsub.cache_clear()
+        self.addCleanup(get_pubsub.cache_clear)
+        with mock.patch.dict("sys.modules", {"redis": redis, "redis.asyncio": redis.asyncio}):
+            pubsub = get_pubsub()
+        self.assertIsInstance(pubsub, RedisPubSub)
+        redis.Redis.from_url.assert_called_once_with("redis://redis:6379/0")
+
+
+class BenchAPI(APITestCase):
+    def test_every_route(self):
+        graph = seed_graph(profiles=50, degree=4, hub_degree=10, messages=10, reserve=2)
+        cases = get_cases(graph)
+        self.assertEqual({x.split(":")[0] for x in cases}, route_names())
+
+        results = run_benchmark(graph, repeat=1)
+        for name, result in results.items():
+            self.assertLess(max(result["statuses"]), 400, name)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite only")
+class SQLiteConnectionTest(APITestCase):
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class ConcurrentFriendAPI(TransactionTestCase):
+    """
+    With the row locks of PostgreSQL, or the database lock of SQLite, on
+    its test database file.
+    """
+    threads = 8
+
+    def setUp(self) -> None:
+        self.profile = Profile.objects.create(username="TestUser1")
+        self.profile2 = Profile.objects.create(username="TestUser2")
+        send_request(self.profile2, self.profile)
+
+    def hammer(self, *targets):
+        errors = []
+        barrier = threading.Barrier(self.threads)
+
+        def run(target):
+            try:
+                barrier.wait()
+                target()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run, args=(targets[x % len(targets)],))
+            for x in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assertFriends(self):
+        self.assertEqual(Friend.objects.count(), 2)
+        self.assertEqual(FriendRequest.objects.count(), 2)
+        self.assertEqual(FriendRequest.objects.filter(accepted=False).count(), 0)
+        self.assertEqual(
+            set(Relationship.objects.values_list("state", flat=True)),
+            {Relationship.FRIENDS},
+        )
+
+    def test_accept(self):
+        self.hammer(lambda: accept_friend(self.profile, self.profile2))
+        self.assertFriends()
+
+    def test_mutual_requests(self):
+        self.hammer(
+            lambda: send_request(self.profile, self.profile2),
+            lambda: send_request(self.profile2, self.profile),
+        )
+        self.assertFriends()
+
+    def test_remove(self):
+        accept_friend(self.profile, self.profile2)
+        removed = []
+        self.hammer(
+            lambda: removed.append(remove_friend(self.profile, self.profile2)),
+            lambda: removed.append(remove_friend(self.profile2, self.profile)),
+        )
+        self.assertEqual(sorted(removed), [False] * (self.threads - 1) + [True])
+        self.assertFalse(Friend.objects.exists())
+        self.assertFalse(Relationship.objects.exists())
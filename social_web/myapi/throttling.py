@@ -0,0 +1,178 @@
+"""
+Throttles of the writes: messages and friend requests.
+
+Every throttle is a token bucket per user, or per pair of users: it holds
+up to ``capacity`` tokens, refilled at ``capacity`` per period, and every
+call takes one. The bursts are allowed up to the capacity, then the calls
+are refused with a 429 and a Retry-After until a token is back.
+
+A call may cost more than one token, e.g. the friend requests sent at
+once by ``bulk``, one per user. It is allowed with a single token left
+and puts the bucket in debt, so the next calls wait for the whole cost to
+be refilled: the same rate for a batch as for the calls one by one.
+
+The rates are in ``settings.MYAPI_THROTTLE_RATES``, e.g. "20/min", by
+scope; a scope without a rate is not throttled. The buckets are kept in
+the cache of myapi: in Redis, a bucket is updated by one Lua script, so
+it is shared by every process; in the other caches, under a lock of
+this process.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+from myapi.cache import get_cache
+
+PERIODS = {"s": 1, "sec": 1, "min": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+# Refused calls of this process, by scope
+rejected = Counter()
+
+lock = threading.Lock()
+
+BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "time")
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "time", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def parse_rate(rate):
+    """
+    Capacity and refill per second of a rate, e.g. "20/min" is (20, 1/3).
+    """
+    count, period = rate.split("/")
+    return int(count), int(count) / PERIODS[period]
+
+
+def take_token(key, capacity, refill, cost=1):
+    """
+    Take cost tokens of the bucket, return the seconds to wait for one, 0
+    if they were taken.
+    """
+    cache = get_cache()
+    if isinstance(cache, RedisCache):
+        key = cache.make_key(key)
+        client = cache._cache.get_client(key, write=True)
+        allowed, tokens = client.eval(BUCKET_SCRIPT, 1, key, capacity, refill, cost)
+        return 0 if allowed else (1 - float(tokens)) / refill
+
+    with lock:
+        now = time.time()
+        tokens, last = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill)
+        wait = 0 if tokens >= 1 else (1 - tokens) / refill
+        if not wait:
+            tokens -= cost
+        # Until the bucket is full again
+        cache.set(key, (tokens, now), (capacity - tokens) / refill + 1)
+    return wait
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Token bucket of a scope, keyed by what ``get_ident`` returns.
+    """
+    scope = None
+
+    def get_ident(self, request, view):
+        return request.user.pk
+
+    def get_cost(self, request, view):
+        return 1
+
+    def allow_request(self, request, view):
+        rate = getattr(settings, "MYAPI_THROTTLE_RATES", {}).get(self.scope)
+        ident = self.get_ident(request, view) if request.user.is_authenticated else None
+        if rate is None or ident is None:
+            return True
+
+        capacity, refill = parse_rate(rate)
+        self.wait_time = take_token(
+            f"myapi:throttle:{self.scope}:{ident}",
+            capacity,
+            refill,
+            self.get_cost(request, view),
+        )
+        if self.wait_time:
+            rejected[self.scope] += 1
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+class PairThrottle(BucketThrottle):
+    """
+    Token bucket of a scope for every user and other user, taken from the
+    ``pk`` of the URL or the ``field`` of the data.
+    """
+    field = None
+
+    def get_ident(self, request, view):
+        other = view.kwargs.get("pk")
+        if other is None and self.field:
+            other = request.data.get(self.field)
+        try:
+            return f"{request.user.pk}:{int(other)}"
+        except (TypeError, ValueError):
+            # Refused by the view anyway
+            return None
+
+
+class MessageUserThrottle(BucketThrottle):
+    scope = "message_user"
+
+
+class MessagePairThrottle(PairThrottle):
+    scope = "message_pair"
+
+
+class RequestUserThrottle(BucketThrottle):
+    scope = "request_user"
+
+
+class RequestBulkThrottle(RequestUserThrottle):
+    """
+    Bucket of the friend requests of the user, one token per user of the
+    batch.
+    """
+    fields = ["usernames", "ids"]
+
+    def get_cost(self, request, view):
+        data = request.data
+        count = 0
+        for field in self.fields:
+            values = data.getlist(field) if hasattr(data, "getlist") else data.get(field)
+            if isinstance(values, list):
+                count += len(values)
+        # Refused by the view anyway when empty
+        return max(1, count)
+
+
+class RequestPairThrottle(PairThrottle):
+    scope = "request_pair"
+    field = "to_user"
+
+
+def get_stats():
+    return {"rejected": dict(rejected)}
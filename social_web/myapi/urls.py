@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import views, async_views
 
 
 router = DefaultRouter()
@@ -11,7 +11,14 @@ router.register(r"token_auth", views.TokenAuthenticateViewSet, basename="token_a
 router.register(r"profile", views.ProfileViewSet, basename="profile",)
 router.register(r"friends", views.FriendViewSet, basename="friends",)
 router.register(r"requests", views.RequestViewSet, basename="requests"),
+router.register(r"cache_stats", views.CacheStatsViewSet, basename="cache_stats",)
+router.register(r"throttle_stats", views.ThrottleStatsViewSet, basename="throttle_stats",)
+router.register(r"profiling", views.ProfilingViewSet, basename="profiling",)
 
 urlpatterns = [
+    path("async/friends/", async_views.friends_list, name="async-friends-list"),
+    path("async/friends/<int:pk>/", async_views.friends_detail, name="async-friends-detail"),
+    path("async/requests/", async_views.requests_list, name="async-requests-list"),
+    path("async/requests/<int:pk>/", async_views.requests_detail, name="async-requests-detail"),
     path("", include(router.urls)),
 ]
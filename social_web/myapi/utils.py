@@ -1,46 +1,292 @@
 import datetime
 
 import jwt
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
 
-from users_site.models import FriendRequest, Friend
+from myapi.cache import invalidate, FRIENDS, REQUESTS, PROFILE
+from myapi.graph import record_friends
+from myapi.tasks import emit
+from users_site.models import Profile, FriendRequest, Friend, Message, Relationship
 
 
 def remove_user_from_friends(me, friend):
-    data = check_friends(me, friend)[0]
-    data.delete()
+    check_friends(me, friend).delete()
+    Relationship.objects.filter(user=me, other=friend).delete()
+    record_friends(removed=[(me.id, friend.id)])
+    invalidate(FRIENDS, me)
 
 
 def remove_me_from_friends(me, friend):
-    data = check_friends(friend=me, me=friend)[0]
-    data.delete()
+    check_friends(friend=me, me=friend).delete()
+    Relationship.objects.filter(user=friend, other=me).delete()
+    record_friends(removed=[(friend.id, me.id)])
+    invalidate(FRIENDS, friend)
 
 
 def remove_requests(me, friend):
-    data_to_me = check_incoming(me, friend)
-    data_from_me = check_outgoing(me, friend)
-    data_to_me.delete()
-    data_from_me.delete()
+    reject_requests(me, [friend])
+
+
+def reject_requests(me, friends):
+    """
+    Remove the requests between the user and the friends, both ways.
+    """
+    FriendRequest.objects.filter(
+        Q(to_user=me, from_user__in=friends) | Q(to_user__in=friends, from_user=me)
+    ).delete()
+    set_relationships(me, friends, Relationship.NONE)
+    invalidate(REQUESTS, me, *friends)
+    emit("requests.rejected", {"user": me.id, "others": [x.id for x in friends]})
+
+
+def remove_messages(me, friend):
+    Message.objects.filter(
+        conversation=Message.conversation_key(me, friend),
+    ).delete()
+
+
+def invalidate_profile(me):
+    """
+    Drop the cached lists which show the user, e.g. after a new username.
+    """
+    others = list(
+        Relationship.objects.filter(user=me).values_list("other", flat=True)
+    )
+    invalidate(FRIENDS, me, *others)
+    invalidate(REQUESTS, me, *others)
+    invalidate(PROFILE, me)
 
 
 def request_handler(me, friend):
-    me_req = FriendRequest.objects.create(
-        to_user=friend, from_user=me, accepted=True
+    accept_requests(me, [friend])
+
+
+def accept_requests(me, friends):
+    """
+    Mark the requests between the user and the friends, both ways, as accepted.
+    """
+    FriendRequest.objects.bulk_create(
+        [
+            request
+            for friend in friends
+            for request in (
+                FriendRequest(to_user=friend, from_user=me, accepted=True),
+                FriendRequest(to_user=me, from_user=friend, accepted=True),
+            )
+        ],
+        update_conflicts=True,
+        unique_fields=["to_user", "from_user"],
+        update_fields=["accepted"],
     )
-    friend_req = FriendRequest.objects.filter(
-        to_user=me,
-        from_user=friend,
-    ).update(accepted=True)
+    invalidate(REQUESTS, me, *friends)
+    emit("requests.accepted", {"user": me.id, "others": [x.id for x in friends]})
 
 
 def add_friend(me, friend):
-    in_my_end = Friend.objects.create(
-        user=me,
-        friend=friend,
+    add_friends(me, [friend])
+
+
+def add_friends(me, friends):
+    mine = set(Friend.objects.filter(user=me).values_list("friend", flat=True))
+    new = [x for x in friends if x.id not in mine]
+
+    Friend.objects.bulk_create(
+        [
+            row
+            for friend in friends
+            for row in (Friend(user=me, friend=friend), Friend(user=friend, friend=me))
+        ],
+        ignore_conflicts=True,
+    )
+    set_relationships(me, friends, Relationship.FRIENDS)
+    invalidate(FRIENDS, me, *friends)
+
+    if new:
+        record_friends(
+            added=[row for x in new for row in ((me.id, x.id), (x.id, me.id))]
+        )
+        emit("friends.added", {"users": [me.id, *(x.id for x in new)]})
+
+
+def lock_pair(me, friend):
+    lock_profiles(me, friend)
+
+
+def lock_profiles(*profiles):
+    """
+    Lock the profiles, in id order, until the end of the transaction.
+
+    SQLite has no row locks: a write takes the lock of the database
+    instead, before anything is read, so that a second writer waits for
+    the first to commit and then reads what it wrote.
+    """
+    ids = [getattr(x, "pk", x) for x in profiles]
+    if not connection.features.has_select_for_update:
+        Profile.objects.filter(id__in=ids).update(username=F("username"))
+        return
+    list(
+        Profile.objects.select_for_update().filter(
+            id__in=ids,
+        ).order_by("id").values_list("id", flat=True)
+    )
+
+
+def accept_friend(me, friend):
+    """
+    Accept the requests between the users and make them friends, if the
+    friend's request is still there once the pair is locked, not withdrawn
+    or answered meanwhile. Return whether it was.
+    """
+    with transaction.atomic():
+        lock_pair(me, friend)
+        if not Relationship.objects.filter(
+            user=me, other=friend, state=Relationship.INCOMING,
+        ).exists():
+            return False
+        request_handler(me, friend)
+        add_friend(me=me, friend=friend)
+    return True
+
+
+def remove_friend(me, friend):
+    """
+    Remove the users from each other's friends, with their requests and
+    their conversation, if they are still friends once the pair is locked,
+    not removed meanwhile. Return whether they were.
+    """
+    with transaction.atomic():
+        lock_pair(me, friend)
+        if not Relationship.objects.filter(
+            user=me, other=friend, state=Relationship.FRIENDS,
+        ).exists():
+            return False
+        remove_user_from_friends(me, friend)
+        remove_me_from_friends(me, friend)
+        remove_requests(me, friend)
+        remove_messages(me, friend)
+        emit("friends.removed", {"users": [me.id, friend.id]})
+    return True
+
+
+def send_request(me, friend):
+    """
+    Send a friend request, or accept it if the friend already sent one.
+    Return the state of the user to the friend before the request.
+    """
+    return send_requests(me, [friend])[friend.id]
+
+
+def send_requests(me, friends):
+    """
+    Send friend requests to many users at once, as send_request, with a
+    fixed number of queries.
+    Return the state of the user to every friend before the request, by id.
+    """
+    with transaction.atomic():
+        lock_profiles(me, *friends)
+        states = dict(
+            Relationship.objects.filter(
+                user=me,
+                other__in=friends,
+            ).values_list("other", "state")
+        )
+
+        incoming = [x for x in friends if states.get(x.id) == Relationship.INCOMING]
+        if incoming:
+            accept_requests(me, incoming)
+            add_friends(me, incoming)
+
+        new = [x for x in friends if x.id not in states]
+        if new:
+            FriendRequest.objects.bulk_create(
+                [FriendRequest(to_user=friend, from_user=me) for friend in new]
+            )
+            set_relationships(me, new, Relationship.OUTGOING)
+            invalidate(REQUESTS, me, *new)
+
+    return {x.id: states.get(x.id, Relationship.NONE) for x in friends}
+
+
+def answer_requests(me, friend_ids, accept):
+    """
+    Accept or reject the incoming requests from many users at once.
+    Return the profiles of the users who had sent one.
+    """
+    with transaction.atomic():
+        lock_profiles(me, *friend_ids)
+        friends = [
+            x.other for x in Relationship.objects.select_related("other").filter(
+                user=me,
+                other__in=friend_ids,
+                state=Relationship.INCOMING,
+            )
+        ]
+        if friends and accept:
+            accept_requests(me, friends)
+            add_friends(me, friends)
+        elif friends:
+            reject_requests(me, friends)
+
+    return friends
+
+
+def set_relationship(me, friend, state):
+    set_relationships(me, [friend], state)
+
+
+def set_relationships(me, friends, state):
+    """
+    Store the state of the user to every friend, and of them to the user.
+    """
+    if state == Relationship.NONE:
+        Relationship.objects.filter(
+            Q(user=me, other__in=friends) | Q(user__in=friends, other=me)
+        ).delete()
+        return
+
+    Relationship.objects.bulk_create(
+        [
+            row
+            for friend in friends
+            for row in (
+                Relationship(user=me, other=friend, state=state),
+                Relationship(
+                    user=friend, other=me, state=Relationship.MIRROR[state]
+                ),
+            )
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "other"],
+        update_fields=["state"],
     )
-    on_his_end = Friend.objects.create(
-        user=friend,
-        friend=me,
+
+
+def get_relationship(me, friend_id):
+    """
+    Get the relationship of the user with some other user, if any.
+    """
+    return Relationship.objects.select_related("other").filter(
+        user=me,
+        other=friend_id,
+    ).first()
+
+
+def get_relationships(me, friend_ids):
+    """
+    Get the state of the user with every user of the list.
+    """
+    states = dict(
+        Relationship.objects.filter(
+            user=me,
+            other__in=friend_ids,
+        ).values_list("other", "state")
     )
+    return {
+        friend_id: states.get(friend_id, Relationship.NONE)
+        for friend_id in friend_ids
+    }
 
 
 def check_friends(me, friend):
@@ -84,16 +330,27 @@ def check_outgoing(me, friend):
     return friendship
 
 
+async def aget_relationship(me, friend_id):
+    return await Relationship.objects.select_related("other").filter(
+        user=me,
+        other=friend_id,
+    ).afirst()
+
+
 def create_jwt(user):
     payload = {
         "id": user.id,
+        "profile_id": Profile.objects.filter(user=user).values_list(
+            "id", flat=True
+        ).first(),
+        "username": user.username,
         "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1),
         "iat": datetime.datetime.utcnow(),
     }
 
-    token = jwt.encode(payload, 'SECRET', algorithm="HS256")
+    token = jwt.encode(payload, settings.JWT_SECRET_KEY, algorithm="HS256")
     return token
 
 
 def decode_jwt(token):
-    return jwt.decode(token, 'SECRET', algorithms=["HS256", ])
+    return jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256", ])
@@ -1,12 +1,18 @@
+from collections import defaultdict
+
 import jwt
-from django.contrib.auth import login
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.viewsets import GenericViewSet, ViewSet, ModelViewSet
 
 from myapi.serializers import (
@@ -17,18 +23,48 @@ from myapi.serializers import (
     RequestDetailSerializer,
     LoginSerializer,
     MessageSerializer,
+    MessageListSerializer,
+    BulkRequestSerializer,
+    BulkAnswerSerializer,
 )
 from myapi.utils import (
-    request_handler,
-    add_friend,
+    accept_friend,
+    send_request,
+    send_requests,
+    answer_requests,
     remove_requests,
     check_incoming,
     check_outgoing,
-    remove_user_from_friends,
-    remove_me_from_friends,
+    remove_friend,
+    invalidate_profile,
+    set_relationship,
+    get_relationship,
+    get_relationships,
     check_friends, create_jwt, decode_jwt,
 )
-from users_site.models import Profile, Friend
+from myapi.authentication import JWTUser
+from myapi.cache import get_or_build, get_stats, FRIENDS, REQUESTS, PROFILE
+from myapi.export import EXPORTS, iter_messages
+from myapi.graph import get_graph
+from myapi.mixins import CurrentProfileMixin, conditional
+from myapi.pagination import (
+    MessageCursorPagination,
+    FriendCursorPagination,
+    SearchPagination,
+)
+from myapi.profiling import get_rate, set_rate, list_profiles
+from myapi.pubsub import publish_message
+from myapi.suggestions import get_suggestions
+from myapi.throttling import (
+    MessageUserThrottle,
+    MessagePairThrottle,
+    RequestUserThrottle,
+    RequestBulkThrottle,
+    RequestPairThrottle,
+    get_stats as get_throttle_stats,
+)
+from users_site.models import Profile, Message, Relationship
+from users_site.search import search_profiles
 
 
 class UserRegistrationViewSet(GenericViewSet):
@@ -85,10 +121,7 @@ class TokenAuthenticateViewSet(ViewSet):
     def list(self, request):
         token = request.COOKIES.get("jwt")
         try:
-            data = decode_jwt(token)
-
-            user = User.objects.get(id=data["id"])
-            login(request, user)
+            user = JWTUser(decode_jwt(token))
 
             return Response({"message": f"User {user.username} authorize"})
 
@@ -102,7 +135,46 @@ class TokenAuthenticateViewSet(ViewSet):
             raise AuthenticationFailed(f"{e}")
 
 
+class CacheStatsViewSet(ViewSet):
+    permission_classes = [IsAdminUser, ]
+
+    def list(self, request):
+        """Hit and miss counters of the lists cache."""
+        return Response(get_stats())
+
+
+class ThrottleStatsViewSet(ViewSet):
+    permission_classes = [IsAdminUser, ]
+
+    def list(self, request):
+        """Counters of the calls refused by the throttles, by scope."""
+        return Response(get_throttle_stats())
+
+
+class ProfilingViewSet(ViewSet):
+    permission_classes = [IsAdminUser, ]
+
+    def list(self, request):
+        """Rate of the profiled requests, and the last profiles."""
+        return Response({"rate": get_rate(), "profiles": list_profiles()})
+
+    def create(self, request):
+        """Profile the fraction ``rate`` of the requests, 0 to stop."""
+        try:
+            rate = float(request.data.get("rate"))
+        except (TypeError, ValueError):
+            rate = None
+        if rate is None or not 0 <= rate <= 1:
+            return Response(
+                {"message": "Rate must be a number from 0 to 1"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        set_rate(rate)
+        return Response({"rate": rate}, status=status.HTTP_200_OK)
+
+
 class ProfileViewSet(
+    CurrentProfileMixin,
     ViewSet,
 ):
     serializer_class = ProfileSerializer
@@ -113,11 +185,9 @@ class ProfileViewSet(
         lookup_value = self.kwargs[self.lookup_field]
         return self.queryset.get(**{self.lookup_field: lookup_value})
 
+    @conditional(PROFILE)
     def list(self, request, *args, **kwargs):
-        try:
-            user = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        user = self.get_profile()
 
         return Response(
             self.serializer_class(user).data,
@@ -126,10 +196,7 @@ class ProfileViewSet(
 
     @action(detail=False, methods=['put'])
     def update_user(self, request, *args, **kwargs):
-        try:
-            user = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        user = self.get_profile()
 
         serializer = self.serializer_class(
             user,
@@ -139,6 +206,9 @@ class ProfileViewSet(
         if serializer.is_valid():
             serializer.save()
 
+            # The username is shown in the lists of other users
+            invalidate_profile(user)
+
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -149,20 +219,96 @@ class ProfileViewSet(
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=False, methods=['get'])
+    def search(self, request, *args, **kwargs):
+        """
+        Search the profiles by username with ?q=: the exact matches,
+        then the usernames or their words starting with q, or else the
+        usernames close to q. Paginated with ?page= and ?page_size=.
+        """
+        self.get_profile()
 
-class FriendViewSet(GenericViewSet):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"message": "Query is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(search_profiles(query), request, view=self)
+        usernames = dict(
+            Profile.objects.filter(
+                id__in=[pk for pk, _ in page],
+            ).values_list("id", "username")
+        )
+        return paginator.get_paginated_response(
+            [
+                {"id": pk, "username": usernames[pk], "match": match}
+                for pk, match in page
+                if pk in usernames
+            ]
+        )
+
+
+class FriendViewSet(CurrentProfileMixin, GenericViewSet):
     queryset = Profile.objects.all()
     serializer_class = FriendSerializer
-
+    pagination_class = FriendCursorPagination
+    # Fields of the friends list and their columns
+    friend_fields = {
+        "id": "friend_id",
+        "username": "friend__username",
+    }
+    max_suggestions = 100
+    max_path_hops = 6
+    status_messages = {
+        Relationship.FRIENDS: "Already friends.",
+        Relationship.INCOMING: "Incoming request.",
+        Relationship.OUTGOING: "Outgoing request.",
+    }
+
+    @conditional(FRIENDS)
     def list(self, request: Request, *args, **kwargs) -> Response:
         """
-        View a user's list of friends.
+        View a user's list of friends, page by page.
+
+        ?fields=id,username picks the fields of the friends and
+        ?paginate=false gives the whole list in one response.
         """
+        user = self.get_profile()
+
+        if request.query_params.get("paginate") == "false":
+            # The whole list, as before the pagination
+            context = get_or_build(FRIENDS, user, lambda: self.friends_context(user))
+            return Response(context, status=status.HTTP_200_OK)
+
+        fields = request.query_params.get("fields", "id,username").split(",")
+        if not set(fields) <= set(self.friend_fields):
+            return Response(
+                {"message": f"Fields must be some of: {', '.join(self.friend_fields)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        data = user.user_friends.values(
+            "friend_id",
+            *[self.friend_fields[x] for x in fields],
+        )
+        page = self.paginate_queryset(data)
+
+        context = {}
+        context["user"] = {"id": user.id, "username": user.username}
+        context["next"] = self.paginator.get_next_link()
+        context["previous"] = self.paginator.get_previous_link()
+        context["friends"] = [
+            {x: row[self.friend_fields[x]] for x in fields} for row in page
+        ]
+
+        return Response(context, status=status.HTTP_200_OK)
+
+    @classmethod
+    def friends_context(cls, user):
         context = {}
-        try:
-            user = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
 
         # My data
         context["user"] = {}
@@ -180,44 +326,154 @@ class FriendViewSet(GenericViewSet):
         ]
         context["friends"] = friends_list
 
-        return Response(context, status=status.HTTP_200_OK)
+        return context
 
-    @action(detail=True, methods=["get"])
+    @action(
+        detail=True,
+        methods=["get"],
+        pagination_class=MessageCursorPagination,
+    )
     def list_message(self, request, pk, *args, **kwargs) -> Response:
-        try:
-            me = self.queryset.get(username=request.user)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        """
+        Get the conversation with a friend, page by page.
 
-        if request.user.id == int(pk):
+        ?after_id=<message id> or ?since=<ISO 8601 time> give only the
+        newer messages, oldest first, to sync a conversation the client
+        already has.
+        """
+        me = self.get_profile()
+
+        if me.id == int(pk):
             return Response(
                 {"message": "Hello I am you"},
                 status=status.HTTP_200_OK,
             )
 
-        message_from_me = Friend.objects.filter(
-            user=request.user.id,
-            friend=int(pk),
-        ).first()
+        if not check_friends(me, int(pk)):
+            return Response(
+                {"message": f"User {pk} is not you're friend"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        data = Message.objects.select_related("sender").filter(
+            conversation=Message.conversation_key(me, int(pk)),
+        )
+
+        params = request.query_params
+        if "after_id" in params or "since" in params:
+            return self.new_messages(request, data)
 
-        data = message_from_me.message
+        page = self.paginate_queryset(data)
 
-        format_text = data.split("\n")
+        return self.get_paginated_response(
+            MessageListSerializer(page, many=True).data
+        )
+
+    def new_messages(self, request, data) -> Response:
+        """
+        Messages after ?after_id= and ?since=, oldest first, with a link
+        to the next ones.
+        """
+        after_id = request.query_params.get("after_id")
+        if after_id is not None:
+            last = None
+            if after_id.isdigit():
+                last = data.filter(id=after_id).values_list("created_at", flat=True).first()
+            if last is None:
+                return Response(
+                    {"message": f"Message {after_id} is not in the conversation"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # In the order of the conversation index, not of the ids
+            data = data.filter(
+                Q(created_at__gt=last) | Q(created_at=last, id__gt=after_id)
+            )
+
+        since = request.query_params.get("since")
+        if since is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response(
+                    {"message": "Since must be an ISO 8601 date and time"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            data = data.filter(created_at__gt=since)
+
+        limit = self.paginator.get_page_size(request)
+        messages = list(data.order_by("created_at", "id")[:limit + 1])
+
+        next_link = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_link = replace_query_param(
+                remove_query_param(request.build_absolute_uri(), "since"),
+                "after_id",
+                messages[-1].id,
+            )
 
         return Response(
-            format_text,
+            {
+                "next": next_link,
+                "results": MessageListSerializer(messages, many=True).data,
+            },
             status=status.HTTP_200_OK,
         )
 
-    @action(detail=True, methods=["post"], serializer_class=MessageSerializer)
+    @action(detail=True, methods=["get"])
+    def export_message(self, request, pk, *args, **kwargs):
+        """
+        Download the whole conversation with a friend, oldest first.
+
+        ?type=ndjson (default) or ?type=csv.
+        """
+        me = self.get_profile()
+
+        export_type = request.query_params.get("type", "ndjson")
+        if export_type not in EXPORTS:
+            return Response(
+                {"message": f"Type must be one of: {', '.join(EXPORTS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not check_friends(me, int(pk)):
+            return Response(
+                {"message": f"User {pk} is not you're friend"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        export, content_type = EXPORTS[export_type]
+        conversation = Message.conversation_key(me, int(pk))
+
+        response = StreamingHttpResponse(
+            export(iter_messages(conversation)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="conversation-{conversation.replace(":", "-")}.{export_type}"'
+        )
+        return response
+
+    @action(
+        detail=True,
+        methods=["post"],
+        serializer_class=MessageSerializer,
+        throttle_classes=[MessageUserThrottle, MessagePairThrottle],
+    )
     def create_message(self, request, pk, *args, **kwargs) -> Response:
-        try:
-            me = self.queryset.get(username=request.user)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        user = self.get_profile()
 
-        user = Profile.objects.get(user=request.user.id)
-        friend = Profile.objects.get(id=int(pk))
+        relationship = get_relationship(user, int(pk))
+        if not relationship or relationship.state != Relationship.FRIENDS:
+            return Response(
+                {"message": f"User {pk} is not you're friend"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        friend = relationship.other
 
         serializer = self.get_serializer(data=request.data)
 
@@ -227,6 +483,7 @@ class FriendViewSet(GenericViewSet):
             serializer.validated_data["friend"] = friend
 
             data = serializer.save()
+            publish_message(data)
             return Response(
                 {"message": f"{data}"},
                 status=status.HTTP_200_OK,
@@ -236,56 +493,153 @@ class FriendViewSet(GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-
     def retrieve(self, request: Request, pk, *args, **kwargs) -> Response:
         """
         Get a user friend status with some other user.
         """
         context = {}
 
-        try:
-            me = self.queryset.get(username=request.user)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
+
+        relationship = get_relationship(me, pk)
+        if relationship:
+            friend = relationship.other
+            state = relationship.state
+        else:
+            friend = Profile.objects.filter(id=pk).first()
+            state = Relationship.NONE
 
-        friend = Profile.objects.filter(id=pk).first()
         if not friend:
             return Response(
                 {"message": f"User {pk} dont exist "},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if int(pk) == int(request.user.id):
-            context["username"] = str(friend)
+        context["username"] = str(friend)
+        if int(pk) == me.id:
             context["status"] = "It is you're id man."
 
-        elif check_friends(me, friend):
-            context["username"] = str(friend)
-            context["status"] = "Already friends."
+        elif state in self.status_messages:
+            context["status"] = self.status_messages[state]
 
-        elif check_incoming(me, friend):
-            context["status"] = "Incoming request."
-            context["username"] = str(friend)
-
-        elif check_outgoing(me, friend):
-            context["status"] = "Outgoing request."
-            context["username"] = str(friend)
         else:
             context["status"] = f"Nothing"
-            context["username"] = str(friend)
             return Response(context, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(context, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["get"])
+    def suggestions(self, request: Request, *args, **kwargs) -> Response:
+        """
+        People you may know: the users with the most mutual friends,
+        ?limit= of them (20 by default, 100 at most).
+        """
+        me = self.get_profile()
+
+        limit = request.query_params.get("limit", "20")
+        if not limit.isdigit():
+            return Response(
+                {"message": "Not valid data"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        data = get_suggestions(me, min(int(limit), self.max_suggestions))
+        context = {
+            "suggestions": [
+                {
+                    "id": x.candidate_id,
+                    "username": x.candidate.username,
+                    "mutual": x.mutual,
+                }
+                for x in data
+            ],
+        }
+        return Response(context, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def mutual(self, request: Request, pk, *args, **kwargs) -> Response:
+        """
+        Get the friends the user has in common with some other user.
+        """
+        me = self.get_profile()
+
+        ids = get_graph().mutual(me.id, int(pk))
+        if not ids and not self.queryset.filter(id=pk).exists():
+            return Response(
+                {"message": f"User {pk} dont exist "},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        data = self.queryset.filter(id__in=ids).order_by("id").values("id", "username")
+        return Response(
+            {"count": len(ids), "friends": list(data)},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["get"])
+    def path(self, request: Request, pk, *args, **kwargs) -> Response:
+        """
+        Get the shortest chain of friends to some other user, of at most
+        ?max_hops= friendships (3 by default, 6 at most).
+        """
+        me = self.get_profile()
+
+        max_hops = request.query_params.get("max_hops", "3")
+        if not max_hops.isdigit() or not 0 < int(max_hops) <= self.max_path_hops:
+            return Response(
+                {"message": f"Max hops must be from 1 to {self.max_path_hops}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ids = get_graph().path(me.id, int(pk), int(max_hops))
+        names = dict(self.queryset.filter(id__in=ids or [pk]).values_list("id", "username"))
+        if int(pk) not in names:
+            return Response(
+                {"message": f"User {pk} dont exist "},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if ids is None:
+            context = {"degree": None, "path": []}
+        else:
+            context = {
+                "degree": len(ids) - 1,
+                "path": [{"id": x, "username": names[x]} for x in ids],
+            }
+        return Response(context, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path="status")
+    def statuses(self, request: Request, *args, **kwargs) -> Response:
+        """
+        Get a user friend status with every user from ?ids=1,2,3.
+        """
+        me = self.get_profile()
+
+        try:
+            friend_ids = [
+                int(x) for x in request.query_params.get("ids", "").split(",") if x
+            ]
+        except ValueError:
+            return Response(
+                {"message": "Not valid data"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response(
+            {"statuses": get_relationships(me, friend_ids)},
+            status=status.HTTP_200_OK,
+        )
+
     def destroy(self, request: Request, pk):
         """Remove a user from another user from their friends."""
         context = {}
-        try:
-            me = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
 
-        friend = self.queryset.filter(id=pk).first()
+        relationship = get_relationship(me, pk)
+        if relationship:
+            friend = relationship.other
+        else:
+            friend = self.queryset.filter(id=pk).first()
 
         if not friend:
             return Response(
@@ -298,36 +652,47 @@ class FriendViewSet(GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if check_friends(me, friend):
-            # Remove user from table Friend.
-            remove_user_from_friends(me, friend)
-
-            # Remove me from table Friend.
-            remove_me_from_friends(me, friend)
-
-            # Remove all requests from user and me
-            remove_requests(me, friend)
-
+        is_friend = relationship and relationship.state == Relationship.FRIENDS
+        # Unless removed by another request meanwhile
+        if is_friend and remove_friend(me, friend):
             context["message"] = f"User {friend} was delete from you're friends list"
             return Response(context, status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class RequestViewSet(GenericViewSet):
+class RequestViewSet(CurrentProfileMixin, GenericViewSet):
     serializer_class = RequestSerializer
     queryset = Profile.objects.all()
-
+    # Result of a request of the bulk action, by state before it
+    bulk_statuses = {
+        Relationship.NONE: "sent",
+        Relationship.INCOMING: "accepted",
+        Relationship.OUTGOING: "already_sent",
+        Relationship.FRIENDS: "already_friends",
+    }
+
+    def get_throttles(self):
+        if self.action == "create":
+            return [RequestUserThrottle(), RequestPairThrottle()]
+        if self.action == "bulk":
+            return [RequestBulkThrottle()]
+        return super().get_throttles()
+
+    @conditional(REQUESTS)
     def list(self, request, *args, **kwargs) -> Response:
         """
         View to the user a list of their outgoing and incoming friend requests.
         """
-        context = {}
-        try:
-            me = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
+
+        context = get_or_build(REQUESTS, me, lambda: self.requests_context(me))
+
+        return Response(context, status=status.HTTP_200_OK)
 
+    @classmethod
+    def requests_context(cls, me):
+        context = {}
         context["username"] = str(me.username)
 
         # To me
@@ -352,7 +717,7 @@ class RequestViewSet(GenericViewSet):
         ]
         context["outgoing_requests"] = from_me
 
-        return Response(context, status=status.HTTP_200_OK)
+        return context
 
     def create(self, request, *args, **kwargs):
         """
@@ -361,29 +726,38 @@ class RequestViewSet(GenericViewSet):
         friends, their applications automatically accepted.
         """
         serializer = self.serializer_class(data=request.data)
-        try:
-            me = self.queryset.get(username=request.user)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
 
         if serializer.is_valid():
-            friend_name = serializer.validated_data["to_user"]
-            friend = self.queryset.filter(username=friend_name)[0]
-
-            existing_incoming_request = check_incoming(me, friend)
-
-            if existing_incoming_request:
-                # If there is already a request, then we create
-                # an incoming request and automatically accept both requests
-                request_handler(me, friend)
-
-                # Add automatically to friends
-                add_friend(me=me, friend=friend)
+            friend = serializer.validated_data["to_user"]
+
+            if friend.id == me.id:
+                return Response(
+                    {"message": f"You cant send a request to yourself"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            state = send_request(me, friend)
+
+            if state == Relationship.FRIENDS:
+                return Response(
+                    {"message": f"User {friend} is already you're friend"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            elif state == Relationship.OUTGOING:
+                return Response(
+                    {"message": f"A friend request has already been sent to user {friend}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            elif state == Relationship.INCOMING:
+                # There was already a request, so both requests
+                # were accepted and the users are friends now
                 context = {"message": f"User {friend} add to friends"}
 
             else:
-                # If there is no request, then create a new outgoing request
-                serializer.save(from_user=me)
+                # There was no request, so a new outgoing request was sent
                 context = {"message": f"A friend request has been sent to user {friend}"}
 
             return Response(context, status=status.HTTP_201_CREATED)
@@ -392,24 +766,107 @@ class RequestViewSet(GenericViewSet):
                 {"message": "Not valid data"}, status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=["post"], serializer_class=BulkRequestSerializer)
+    def bulk(self, request: Request) -> Response:
+        """
+        Send friend requests to many users, by username or id, as create.
+
+        Every user gets a result: sent, accepted, already_sent,
+        already_friends, not_found, ambiguous (several users have the
+        username) or yourself.
+        """
+        me = self.get_profile()
+
+        serializer = BulkRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"message": "Not valid data", "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        usernames = serializer.validated_data["usernames"]
+        ids = serializer.validated_data["ids"]
+
+        by_id = {}
+        by_username = defaultdict(list)
+        for profile in self.queryset.filter(Q(username__in=usernames) | Q(id__in=ids)):
+            by_id[profile.id] = profile
+            by_username[profile.username].append(profile)
+
+        results = []
+        friends = {}
+        for key, value, found in (
+            [("username", x, by_username.get(x, [])) for x in usernames]
+            + [("id", x, [by_id[x]] if x in by_id else []) for x in ids]
+        ):
+            result = {key: value}
+            if not found:
+                result["status"] = "not_found"
+            elif len(found) > 1:
+                result["status"] = "ambiguous"
+            elif found[0].id == me.id:
+                result["status"] = "yourself"
+            else:
+                result["id"] = found[0].id
+                friends[found[0].id] = found[0]
+            results.append(result)
+
+        if friends:
+            states = send_requests(me, list(friends.values()))
+            for result in results:
+                if "status" not in result:
+                    result["status"] = self.bulk_statuses[states[result["id"]]]
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"], serializer_class=BulkAnswerSerializer)
+    def bulk_answer(self, request: Request) -> Response:
+        """
+        Accept or reject the friend requests of many users, by id.
+
+        Every user gets a result: accepted, not_accepted or no_request.
+        """
+        me = self.get_profile()
+
+        serializer = BulkAnswerSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"message": "Not valid data", "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        choice = serializer.validated_data["choice"]
+        ids = list(dict.fromkeys(serializer.validated_data["ids"]))
+
+        friends = answer_requests(
+            me, [x for x in ids if x != me.id], accept=choice == "accept"
+        )
+        answered = {x.id for x in friends}
+        answer = "accepted" if choice == "accept" else "not_accepted"
+
+        results = [
+            {"id": x, "status": answer if x in answered else "no_request"}
+            for x in ids
+        ]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
     def retrieve(self, request: Request, pk):
         """Status check with user."""
         context = {}
 
-        try:
-            me = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
+
+        relationship = get_relationship(me, pk)
+        if relationship:
+            user = relationship.other
+        else:
+            user = self.queryset.filter(id=pk).first()
 
-        user = self.queryset.filter(id=pk).first()
         if not user:
             return Response(
                 {"message": f"User {pk} dont exist "},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        request_from_me = check_incoming(me, user)
-        if request_from_me:
+        if relationship and relationship.state == Relationship.INCOMING:
             context["message"] = f"User {user.username} wants to add you as a friend"
         else:
             context["message"] = f"Request to friend user {user.username}"
@@ -419,12 +876,14 @@ class RequestViewSet(GenericViewSet):
     @action(detail=True, methods=['post'], serializer_class=RequestDetailSerializer)
     def create_friend(self, request: Request, pk) -> Response:
         """Accept or reject a user's friend request from another user."""
-        try:
-            me = self.queryset.get(id=request.user.id)
-        except Exception as e:
-            raise AuthenticationFailed("Unauthenticated")
+        me = self.get_profile()
+
+        relationship = get_relationship(me, pk)
+        if relationship:
+            friend = relationship.other
+        else:
+            friend = self.queryset.filter(id=pk).first()
 
-        friend = self.queryset.filter(id=pk).first()
         if not friend:
             return Response(
                 {"message": f"User {pk} dont exist "},
@@ -438,25 +897,23 @@ class RequestViewSet(GenericViewSet):
 
         serializer = RequestDetailSerializer(data=request.data)
 
-        friend_request_to_me_exist = check_incoming(me, friend)
-        if friend_request_to_me_exist:
+        if relationship and relationship.state == Relationship.INCOMING:
             context = self.checking_friend_request_acceptance(
                 me, friend, serializer
             )
-            return Response(context)
-        else:
-            return Response({"message": "Not valid data"}, status.HTTP_400_BAD_REQUEST)
+            if context:
+                return Response(context)
+        return Response({"message": "Not valid data"}, status.HTTP_400_BAD_REQUEST)
 
     @classmethod
     def checking_friend_request_acceptance(cls, me, friend, serializer):
         if serializer.is_valid():
             if serializer.validated_data["choice"] == "accept":
 
-                # We create applications and accept them
-                request_handler(me, friend)
-
-                # Add to friend
-                add_friend(me=me, friend=friend)
+                # Accept the applications and add to friend, unless the
+                # request is gone since it was checked
+                if not accept_friend(me, friend):
+                    return None
 
                 return {
                     "message": f"You have accepted the friend request from {friend.username}"
@@ -0,0 +1,134 @@
+"""
+WebSocket channel of a conversation, for the ASGI entry point.
+
+``/ws/friends/<id>/`` accepts the friends of the user ``id``, with the
+JWT cookie set at login or an ``Authorization: Bearer`` header, and
+sends them every new message of the conversation as JSON, in the format
+of ``list_message``. It is a replacement for polling ``list_message``:
+the sockets only listen, the messages are still sent with
+``create_message``.
+
+The browsers send the cookie with the handshakes of any site, so a
+handshake with the ``Origin`` of another site is refused: its host must be
+in ``ALLOWED_HOSTS`` or the origin in ``CSRF_TRUSTED_ORIGINS``.
+
+The queries of the handshake run as those of an HTTP request, in a
+``ThreadSensitiveContext`` of their own, with the old connections closed
+before and after them; an open socket holds no connection.
+
+Refused handshakes are closed with 4401 (not authenticated), 4403 (not
+friends or foreign origin) or 4404 (unknown path), which the servers
+answer with a 403.
+"""
+import asyncio
+import re
+from urllib.parse import urlsplit
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, parse_cookie
+from django.http.request import validate_host
+from rest_framework.exceptions import AuthenticationFailed
+
+from myapi.async_views import get_profile
+from myapi.pubsub import conversation_channel, get_pubsub
+from myapi.utils import aget_relationship
+from users_site.models import Message, Relationship
+
+FRIENDS_PATH = re.compile(r"/ws/friends/(?P<pk>[0-9]+)/?")
+
+
+def get_request(scope):
+    """
+    Request with the headers and cookies of the handshake, to authenticate.
+    """
+    request = HttpRequest()
+    # The handshake is a GET
+    request.method = "GET"
+    for name, value in scope.get("headers", ()):
+        key = "HTTP_" + name.decode("latin1").upper().replace("-", "_")
+        request.META[key] = value.decode("latin1")
+    request.COOKIES = parse_cookie(request.META.get("HTTP_COOKIE", ""))
+    return request
+
+
+def origin_allowed(request):
+    """
+    Check the Origin of the handshake. The clients which are not browsers
+    send none.
+    """
+    origin = request.META.get("HTTP_ORIGIN")
+    if origin is None:
+        return True
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    try:
+        host = urlsplit(origin).hostname
+    except ValueError:
+        return False
+    return bool(host) and validate_host(host, settings.ALLOWED_HOSTS)
+
+
+async def authorize(request, pk):
+    """
+    Profile of the user of the handshake and the close code of a refusal,
+    None when the user is a friend of pk.
+    """
+    async with ThreadSensitiveContext():
+        await sync_to_async(close_old_connections)()
+        try:
+            try:
+                me = await get_profile(request)
+            except AuthenticationFailed:
+                return None, 4401
+            relationship = await aget_relationship(me, pk)
+            if not relationship or relationship.state != Relationship.FRIENDS:
+                return me, 4403
+            return me, None
+        finally:
+            await sync_to_async(close_old_connections)()
+
+
+async def wait_disconnect(receive):
+    while (await receive())["type"] != "websocket.disconnect":
+        pass
+
+
+async def websocket_application(scope, receive, send):
+    if (await receive())["type"] != "websocket.connect":
+        return
+
+    match = FRIENDS_PATH.fullmatch(scope["path"])
+    if not match:
+        await send({"type": "websocket.close", "code": 4404})
+        return
+
+    request = get_request(scope)
+    if not origin_allowed(request):
+        await send({"type": "websocket.close", "code": 4403})
+        return
+
+    pk = int(match["pk"])
+    me, code = await authorize(request, pk)
+    if code:
+        await send({"type": "websocket.close", "code": code})
+        return
+
+    channel = conversation_channel(Message.conversation_key(me, pk))
+    async with get_pubsub().subscribe(channel) as get_message:
+        await send({"type": "websocket.accept"})
+
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            while True:
+                message = asyncio.ensure_future(get_message())
+                await asyncio.wait(
+                    {message, disconnect}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnect.done():
+                    message.cancel()
+                    break
+                await send({"type": "websocket.send", "text": message.result()})
+        finally:
+            disconnect.cancel()
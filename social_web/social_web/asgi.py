@@ -2,6 +2,8 @@
 ASGI config for social_web project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The HTTP requests go to Django, the WebSocket connections to
+``myapi.websockets``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "social_web.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Import after the setup of Django, the module uses the models.
+from myapi.websockets import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,16 @@
+"""
+Settings of the environment named by DJANGO_ENV: ``dev``, the default,
+with the debug toolbar, or ``prod``.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+DJANGO_ENV = os.environ.get("DJANGO_ENV", "dev")
+
+if DJANGO_ENV == "dev":
+    from .dev import *  # noqa: F401,F403
+elif DJANGO_ENV == "prod":
+    from .prod import *  # noqa: F401,F403
+else:
+    raise ImproperlyConfigured(f"Unknown DJANGO_ENV: {DJANGO_ENV}")
@@ -0,0 +1,41 @@
+"""
+Development settings: DEBUG, the debug toolbar, the log of the N+1 and
+slow queries, and the background tasks run in the process.
+"""
+import os
+
+from .base import *  # noqa: F401,F403
+from .base import INSTALLED_APPS, MIDDLEWARE, MYAPI_TASKS
+
+DEBUG = True
+
+INTERNAL_IPS = [
+    "127.0.0.1",
+]
+
+INSTALLED_APPS = [
+    *INSTALLED_APPS,
+    "debug_toolbar",
+]
+
+MIDDLEWARE = [
+    *MIDDLEWARE,
+    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "myapi.querycheck.QueryCheckMiddleware",
+]
+
+MYAPI_TASKS = {
+    **MYAPI_TASKS,
+    "EAGER": os.environ.get("TASKS_EAGER", "1") == "1",
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "myapi.queries": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
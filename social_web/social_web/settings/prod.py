@@ -0,0 +1,52 @@
+"""
+Production settings.
+
+Without DEBUG, Django keeps no log of the executed queries, and nothing
+of the debug toolbar is loaded. The templates are compiled once per
+process by the cached loader.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+
+DEBUG = False
+
+try:
+    SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+except KeyError:
+    raise ImproperlyConfigured("DJANGO_SECRET_KEY must be set in production.")
+
+JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", SECRET_KEY)
+
+# The metrics show the traffic of every view
+try:
+    MYAPI_METRICS_TOKEN = os.environ["METRICS_TOKEN"]
+except KeyError:
+    raise ImproperlyConfigured("METRICS_TOKEN must be set in production.")
+
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost").split(",")
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [],
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
+        },
+    },
+]
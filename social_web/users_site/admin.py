@@ -4,12 +4,26 @@ from users_site.models import (
     Profile,
     Friend,
     FriendRequest,
+    FriendSuggestion,
+    Task,
 )
+from users_site.search import search_profiles
 
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ["username", "id"]
+    search_fields = ["username"]
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Look the term up in the search index, instead of a LIKE scan of
+        every username.
+        """
+        if not search_term.strip():
+            return queryset, False
+        ids = [pk for pk, _ in search_profiles(search_term)]
+        return queryset.filter(id__in=ids), False
 
 
 @admin.register(Friend)
@@ -20,3 +34,14 @@ class FriendsAdmin(admin.ModelAdmin):
 @admin.register(FriendRequest)
 class RequestAdmin(admin.ModelAdmin):
     list_display = ["from_user", "to_user", "accepted"]
+
+
+@admin.register(FriendSuggestion)
+class SuggestionAdmin(admin.ModelAdmin):
+    list_display = ["user", "candidate", "mutual"]
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ["name", "run_at", "attempts", "failed"]
+    list_filter = ["failed", "name"]
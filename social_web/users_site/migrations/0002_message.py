@@ -0,0 +1,51 @@
+# Generated by Django 4.2.1 on 2026-10-18 20:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Message",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "conversation",
+                    models.CharField(max_length=41, verbose_name="Conversation"),
+                ),
+                ("text", models.TextField(verbose_name="Text")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "sender",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sent_messages",
+                        to="users_site.profile",
+                        verbose_name="Sender",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["conversation", "created_at", "id"],
+                        name="message_conversation_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def parse_line(line):
+    """
+    Parse a "2023.05.20|14:03|username: text" line of the old chat log.
+    """
+    parts = line.split("|", 2)
+    if len(parts) != 3 or ": " not in parts[2]:
+        return None
+    try:
+        created_at = datetime.datetime.strptime(
+            f"{parts[0]}|{parts[1]}", "%Y.%m.%d|%H:%M"
+        )
+    except ValueError:
+        return None
+    username, text = parts[2].split(": ", 1)
+    return timezone.make_aware(created_at), username, text
+
+
+def copy_friend_messages(apps, schema_editor):
+    Friend = apps.get_model("users_site", "Friend")
+    Message = apps.get_model("users_site", "Message")
+
+    # Both sides of a friendship keep the same log, so read it only once.
+    seen = set()
+    batch = []
+    rows = Friend.objects.exclude(message="").values(
+        "user_id",
+        "friend_id",
+        "message",
+        "friend__username",
+    ).order_by("id")
+
+    for row in rows.iterator():
+        ids = sorted([row["user_id"], row["friend_id"]])
+        conversation = f"{ids[0]}:{ids[1]}"
+        if conversation in seen:
+            continue
+        seen.add(conversation)
+
+        last = None
+        for line in row["message"].split("\n"):
+            if not line:
+                continue
+            parsed = parse_line(line)
+            if parsed is None:
+                # Message text with a line break in it.
+                if last is not None:
+                    last.text += f"\n{line}"
+                continue
+            created_at, username, text = parsed
+            if username == row["friend__username"]:
+                sender_id = row["friend_id"]
+            else:
+                sender_id = row["user_id"]
+            last = Message(
+                conversation=conversation,
+                sender_id=sender_id,
+                text=text,
+                created_at=created_at,
+            )
+            batch.append(last)
+
+        if len(batch) >= BATCH_SIZE:
+            Message.objects.bulk_create(batch)
+            batch = []
+
+    Message.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0002_message"),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_friend_messages, migrations.RunPython.noop),
+    ]
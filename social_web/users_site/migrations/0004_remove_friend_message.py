@@ -0,0 +1,16 @@
+# Generated by Django 4.2.1 on 2026-10-18 20:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0003_copy_friend_messages"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="friend",
+            name="message",
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.1 on 2026-10-18 20:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0004_remove_friend_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Relationship",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("none", "None"),
+                            ("outgoing", "Outgoing request"),
+                            ("incoming", "Incoming request"),
+                            ("friends", "Friends"),
+                        ],
+                        default="none",
+                        max_length=10,
+                        verbose_name="State",
+                    ),
+                ),
+                (
+                    "other",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="users_site.profile",
+                        verbose_name="Other user",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="relationships",
+                        to="users_site.profile",
+                        verbose_name="User",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="relationship",
+            constraint=models.UniqueConstraint(
+                fields=("user", "other"), name="unique_relationship"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def fill_relationship(apps, schema_editor):
+    Friend = apps.get_model("users_site", "Friend")
+    FriendRequest = apps.get_model("users_site", "FriendRequest")
+    Relationship = apps.get_model("users_site", "Relationship")
+
+    batch = []
+
+    def add(user_id, other_id, state):
+        batch.append(Relationship(user_id=user_id, other_id=other_id, state=state))
+        if len(batch) >= BATCH_SIZE:
+            flush()
+
+    def flush():
+        Relationship.objects.bulk_create(batch, ignore_conflicts=True)
+        batch.clear()
+
+    # Friends go first, so a stale pending request never hides a friendship.
+    friends = Friend.objects.values_list("user_id", "friend_id")
+    for user_id, friend_id in friends.iterator():
+        add(user_id, friend_id, "friends")
+    flush()
+
+    pending = FriendRequest.objects.filter(accepted=False).values_list(
+        "from_user_id", "to_user_id"
+    )
+    for from_user_id, to_user_id in pending.iterator():
+        add(from_user_id, to_user_id, "outgoing")
+        add(to_user_id, from_user_id, "incoming")
+    flush()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0005_relationship"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_relationship, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def remove_duplicates(model, fields, ordering):
+    """
+    Keep the first row of every group of rows with the same fields.
+    """
+    groups = model.objects.values(*fields).annotate(
+        rows=Count("id"),
+    ).filter(rows__gt=1).order_by()
+
+    for group in list(groups):
+        group.pop("rows")
+        ids = list(
+            model.objects.filter(**group).order_by(*ordering).values_list(
+                "id", flat=True
+            )
+        )
+        model.objects.filter(id__in=ids[1:]).delete()
+
+
+def remove_duplicate_friends(apps, schema_editor):
+    Friend = apps.get_model("users_site", "Friend")
+    FriendRequest = apps.get_model("users_site", "FriendRequest")
+
+    remove_duplicates(Friend, ["user", "friend"], ["id"])
+    # An accepted request wins over the pending copies of it.
+    remove_duplicates(FriendRequest, ["to_user", "from_user"], ["-accepted", "id"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0006_fill_relationship"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_friends, migrations.RunPython.noop),
+    ]
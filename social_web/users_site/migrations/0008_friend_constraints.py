@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0007_remove_duplicate_friends"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="friendrequest",
+            index=models.Index(
+                condition=models.Q(("accepted", False)),
+                fields=["to_user"],
+                name="pending_to_user_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="friendrequest",
+            index=models.Index(
+                condition=models.Q(("accepted", False)),
+                fields=["from_user"],
+                name="pending_from_user_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="friend",
+            constraint=models.UniqueConstraint(
+                fields=("user", "friend"), name="unique_friend"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="friendrequest",
+            constraint=models.UniqueConstraint(
+                fields=("to_user", "from_user"), name="unique_friend_request"
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+MAX_LENGTH = 100
+
+WORD = re.compile(r"[^\W_]+")
+
+
+# Copies of users_site.search as of this migration, which must not
+# import the models of the current code.
+def normalize(text):
+    return " ".join(text.casefold().split())[:MAX_LENGTH]
+
+
+def search_terms(username):
+    name = normalize(username)
+    if not name:
+        return set()
+    return {name, *WORD.findall(name)}
+
+
+def trigrams(text):
+    padded = f"  {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def fill_search_index(apps, schema_editor):
+    Profile = apps.get_model("users_site", "Profile")
+    SearchTerm = apps.get_model("users_site", "SearchTerm")
+    SearchTrigram = apps.get_model("users_site", "SearchTrigram")
+
+    terms = []
+    grams = []
+
+    def flush():
+        SearchTerm.objects.bulk_create(terms, ignore_conflicts=True)
+        SearchTrigram.objects.bulk_create(grams, ignore_conflicts=True)
+        terms.clear()
+        grams.clear()
+
+    profiles = Profile.objects.values_list("id", "username")
+    for profile_id, username in profiles.iterator():
+        terms.extend(SearchTerm(profile_id=profile_id, term=x) for x in search_terms(username))
+        grams.extend(SearchTrigram(profile_id=profile_id, trigram=x) for x in trigrams(username))
+        if len(grams) >= BATCH_SIZE:
+            flush()
+    flush()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0010_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.1 on 2026-10-18 23:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0011_fill_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Task",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, verbose_name="Name")),
+                ("payload", models.JSONField(verbose_name="Payload")),
+                (
+                    "run_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Run at"
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(
+                        default=0, verbose_name="Attempts"
+                    ),
+                ),
+                ("failed", models.BooleanField(default=False, verbose_name="Failed")),
+                ("error", models.TextField(blank=True, verbose_name="Last error")),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("failed", False)),
+                        fields=["run_at", "id"],
+                        name="task_due_idx",
+                    )
+                ],
+            },
+        ),
+    ]
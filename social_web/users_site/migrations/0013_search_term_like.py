@@ -0,0 +1,30 @@
+from django.db import migrations
+
+INDEX = "search_term_like"
+
+
+def create_index(apps, schema_editor):
+    # For the LIKE of the prefixes under any collation. Elsewhere it would
+    # be a second index on term, which the unique index already covers.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    SearchTerm = apps.get_model("users_site", "SearchTerm")
+    schema_editor.execute(
+        f"CREATE INDEX {INDEX} ON {SearchTerm._meta.db_table} (term varchar_pattern_ops)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users_site", "0012_task"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.db import models
+from django.utils import timezone
 
 
 class Profile(models.Model):
@@ -21,6 +22,21 @@ class Profile(models.Model):
         ],
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._indexed_username = instance.__dict__.get("username")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Keep the search index in step with the username
+        if getattr(self, "_indexed_username", None) != self.username:
+            from users_site.search import index_profiles
+
+            index_profiles([self])
+            self._indexed_username = self.username
+
     def __str__(self):
         return self.username
 
@@ -38,9 +54,14 @@ class Friend(models.Model):
         on_delete=models.CASCADE,
         related_name="list_friend",
     )
-    message = models.TextField(
-        verbose_name="Messages",
-    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "friend"],
+                name="unique_friend",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user}"
@@ -62,5 +83,258 @@ class FriendRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     accepted = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["to_user", "from_user"],
+                name="unique_friend_request",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["to_user"],
+                condition=models.Q(accepted=False),
+                name="pending_to_user_idx",
+            ),
+            models.Index(
+                fields=["from_user"],
+                condition=models.Q(accepted=False),
+                name="pending_from_user_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"To: {self.to_user}, From: {self.from_user}"
+
+
+class Message(models.Model):
+    conversation = models.CharField(
+        verbose_name="Conversation",
+        max_length=41,
+    )
+    sender = models.ForeignKey(
+        Profile,
+        verbose_name="Sender",
+        on_delete=models.CASCADE,
+        related_name="sent_messages",
+    )
+    text = models.TextField(
+        verbose_name="Text",
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "created_at", "id"],
+                name="message_conversation_idx",
+            ),
+        ]
+
+    @staticmethod
+    def conversation_key(user, friend):
+        """
+        Key shared by both sides of a friendship, e.g. "1:2".
+        """
+        ids = sorted([getattr(user, "pk", user), getattr(friend, "pk", friend)])
+        return f"{int(ids[0])}:{int(ids[1])}"
+
+    def __str__(self):
+        created_at = timezone.localtime(self.created_at)
+        return f"{created_at.strftime('%Y.%m.%d|%H:%M')}|{self.sender}: {self.text}"
+
+
+class Relationship(models.Model):
+    NONE = "none"
+    OUTGOING = "outgoing"
+    INCOMING = "incoming"
+    FRIENDS = "friends"
+    STATES = [
+        (NONE, "None"),
+        (OUTGOING, "Outgoing request"),
+        (INCOMING, "Incoming request"),
+        (FRIENDS, "Friends"),
+    ]
+    MIRROR = {
+        NONE: NONE,
+        OUTGOING: INCOMING,
+        INCOMING: OUTGOING,
+        FRIENDS: FRIENDS,
+    }
+
+    user = models.ForeignKey(
+        Profile,
+        verbose_name="User",
+        on_delete=models.CASCADE,
+        related_name="relationships",
+    )
+    other = models.ForeignKey(
+        Profile,
+        verbose_name="Other user",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    state = models.CharField(
+        verbose_name="State",
+        max_length=10,
+        choices=STATES,
+        default=NONE,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "other"],
+                name="unique_relationship",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.other}: {self.state}"
+
+
+class FriendSuggestion(models.Model):
+    """
+    Number of mutual friends of a user with some other user.
+
+    Both directions of a pair are stored, with the same count, so the
+    suggestions of a user are one range of the rank index. A background
+    task counts those of the users again as their friends come and go;
+    ``manage.py rebuild_suggestions`` computes them from scratch.
+    """
+    user = models.ForeignKey(
+        Profile,
+        verbose_name="User",
+        on_delete=models.CASCADE,
+        related_name="suggestions",
+    )
+    candidate = models.ForeignKey(
+        Profile,
+        verbose_name="Candidate",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    mutual = models.IntegerField(
+        verbose_name="Mutual friends",
+        default=0,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "candidate"],
+                name="unique_suggestion",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-mutual", "candidate"],
+                name="suggestion_rank_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.candidate}: {self.mutual}"
+
+
+class SearchTerm(models.Model):
+    """
+    Casefolded username of a profile, or one of its words, for the prefix
+    search, a LIKE on PostgreSQL and a range of the unique index on SQLite.
+    Written by ``Profile.save``.
+
+    On PostgreSQL only, migration 0013 adds the ``varchar_pattern_ops``
+    index of the LIKE, which the unique index covers elsewhere.
+    """
+    profile = models.ForeignKey(
+        Profile,
+        verbose_name="Profile",
+        on_delete=models.CASCADE,
+        related_name="search_terms",
+    )
+    term = models.CharField(
+        verbose_name="Term",
+        max_length=100,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["term", "profile"],
+                name="unique_search_term",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.term}: {self.profile}"
+
+
+class SearchTrigram(models.Model):
+    """
+    Trigram of the casefolded username of a profile, for the fuzzy search.
+    Written by ``Profile.save``.
+    """
+    profile = models.ForeignKey(
+        Profile,
+        verbose_name="Profile",
+        on_delete=models.CASCADE,
+        related_name="search_trigrams",
+    )
+    trigram = models.CharField(
+        verbose_name="Trigram",
+        max_length=3,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["trigram", "profile"],
+                name="unique_search_trigram",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.trigram}: {self.profile}"
+
+
+class Task(models.Model):
+    """
+    Task of the background queue of myapi.tasks: the name of its handler
+    and the payload of the event. Deleted once done; kept as failed
+    after the last attempt.
+    """
+    name = models.CharField(
+        verbose_name="Name",
+        max_length=100,
+    )
+    payload = models.JSONField(
+        verbose_name="Payload",
+    )
+    run_at = models.DateTimeField(
+        verbose_name="Run at",
+        default=timezone.now,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name="Attempts",
+        default=0,
+    )
+    failed = models.BooleanField(
+        verbose_name="Failed",
+        default=False,
+    )
+    error = models.TextField(
+        verbose_name="Last error",
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["run_at", "id"],
+                condition=models.Q(failed=False),
+                name="task_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id}"
@@ -0,0 +1,176 @@
+"""
+Search of the profiles by username.
+
+Every profile has rows in two tables, written by ``Profile.save``:
+``SearchTerm`` holds its casefolded username and each word of it, and
+``SearchTrigram`` the trigrams of its casefolded username. A query is
+first looked up as a prefix of the terms, one range of their index.
+When it is the prefix of no term, e.g. after a typo, the profiles
+sharing the most trigrams with the query are ranked by similarity.
+
+A prefix query is a ``LIKE``, right under any collation, which uses the
+``varchar_pattern_ops`` index of the terms on PostgreSQL. The ``LIKE`` of
+SQLite cannot use an index, but its ``BINARY`` collation orders the terms
+by code point, so there the terms starting with the query are also one
+range of the unique index, read up to ``MAX_RESULTS`` rows. A fuzzy query
+reads the rows of the trigrams of the query, a few thousand with a million
+profiles.
+"""
+import math
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from users_site.models import Profile, SearchTerm, SearchTrigram
+
+MAX_RESULTS = 200
+BATCH_SIZE = 1000
+MAX_LENGTH = 100
+# Least similarity of a fuzzy match, as the default of pg_trgm
+MIN_SIMILARITY = 0.3
+
+EXACT = "exact"
+PREFIX = "prefix"
+FUZZY = "fuzzy"
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def normalize(text):
+    return " ".join(text.casefold().split())[:MAX_LENGTH]
+
+
+def search_terms(username):
+    """
+    The username and its words, e.g. "john_smith", "john" and "smith".
+    """
+    name = normalize(username)
+    if not name:
+        return set()
+    return {name, *WORD.findall(name)}
+
+
+def trigrams(text):
+    """
+    Trigrams of the text, padded as pg_trgm does so that its first
+    letters count more, e.g. "  j", " jo", "joh", "ohn" and "hn ".
+    """
+    padded = f"  {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    return len(a & b) / len(a | b) if a or b else 0
+
+
+def index_profiles(profiles):
+    """
+    Replace the index rows of the profiles, from their usernames.
+    """
+    ids = [x.pk for x in profiles]
+    SearchTerm.objects.filter(profile__in=ids).delete()
+    SearchTrigram.objects.filter(profile__in=ids).delete()
+    SearchTerm.objects.bulk_create(
+        [
+            SearchTerm(profile_id=x.pk, term=term)
+            for x in profiles
+            for term in search_terms(x.username)
+        ],
+        ignore_conflicts=True,
+    )
+    SearchTrigram.objects.bulk_create(
+        [
+            SearchTrigram(profile_id=x.pk, trigram=trigram)
+            for x in profiles
+            for trigram in trigrams(x.username)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def rebuild_search_index(batch_size=BATCH_SIZE):
+    """
+    Index every profile again, e.g. after a bulk import, batch_size
+    profiles at a time. Yield the number of profiles done.
+    """
+    profiles = Profile.objects.order_by("id").only("id", "username")
+    done = 0
+    last = 0
+    while True:
+        batch = list(profiles.filter(id__gt=last)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            index_profiles(batch)
+        done += len(batch)
+        last = batch[-1].id
+        yield done
+
+
+def prefix_lookups(query):
+    """
+    Lookups of the terms which start with the query.
+    """
+    lookups = {"term__startswith": query}
+    if connection.vendor == "sqlite":
+        # Bounds of the strings which start with it, in code point order
+        lookups.update(term__gte=query, term__lt=query[:-1] + chr(ord(query[-1]) + 1))
+    return lookups
+
+
+def search_profiles(query, limit=MAX_RESULTS):
+    """
+    Ids of the profiles matching the query, best first, with the kind of
+    match: the exact terms, then the terms starting with the query in
+    alphabetical order, or else the fuzzy matches by similarity.
+    """
+    query = normalize(query)
+    if not query:
+        return []
+
+    terms = SearchTerm.objects.filter(
+        **prefix_lookups(query),
+    ).order_by("term", "profile").values_list("term", "profile")[:limit]
+
+    # The exact terms are the first of the range
+    results = {}
+    for term, profile_id in terms:
+        if profile_id not in results:
+            results[profile_id] = EXACT if term == query else PREFIX
+
+    if not results and len(query) >= 3:
+        for profile_id in fuzzy_search(query, limit):
+            results[profile_id] = FUZZY
+
+    return list(results.items())
+
+
+def fuzzy_search(query, limit):
+    """
+    Ids of the profiles most similar to the query, most similar first.
+    """
+    grams = trigrams(query)
+    # The trigram of the first letter alone is in too many usernames to
+    # be worth reading, and one shared trigram less is enough
+    lookup = [x for x in grams if not x.startswith("  ")]
+    least = max(1, math.ceil(MIN_SIMILARITY * len(grams)) - 1)
+
+    candidates = SearchTrigram.objects.filter(
+        trigram__in=lookup,
+    ).values("profile").annotate(
+        shared=Count("*"),
+    ).filter(
+        shared__gte=least,
+    ).order_by("-shared", "profile").values_list("profile", flat=True)[:limit * 2]
+
+    usernames = Profile.objects.filter(id__in=list(candidates)).values_list("id", "username")
+    scores = {
+        profile_id: similarity(grams, trigrams(username))
+        for profile_id, username in usernames
+    }
+    ranked = sorted(
+        (x for x in scores if scores[x] >= MIN_SIMILARITY),
+        key=lambda x: (-scores[x], x),
+    )
+    return ranked[:limit]